@@ -31,6 +31,8 @@ class BacktestSettings(BaseModel):
     take_profit_long_exit_period: int
     take_profit_short_exit_period: int
     atr_period: int
+    atr_smoothing: str = "sma" # "sma" or "wilder"
+    use_fp32_indicators: bool = False # float32 ATR/exit-band matrices (less memory traffic, ~7 digits)
     stop_loss_atr_multiplier: float
     risk_per_trade: float
     total_portfolio_risk_limit: float
@@ -1,4 +1,7 @@
+import os
+import tempfile
 import unittest
+from math import fsum
 import pandas as pd
 import numpy as np # For NaN and other numerical utilities
 from pandas.testing import assert_series_equal, assert_frame_equal
@@ -78,6 +81,22 @@ class TestTradingLogic(unittest.TestCase):
         assert_series_equal(upper, expected_upper, check_dtype=False)
         assert_series_equal(lower, expected_lower, check_dtype=False)
 
+    def test_donchian_bands_by_segment_matches_rolling(self):
+        # Two series back to back; windows must not straddle the boundary, and NaNs behave as in pandas
+        first_high = pd.Series([10, 12, np.nan, 13, 11, 14], dtype=float)
+        first_low = pd.Series([8, 9, 7, 10, np.nan, 12], dtype=float)
+        second_high = pd.Series([20, 21, 19, 22], dtype=float)
+        second_low = pd.Series([18, 17, 16, 19], dtype=float)
+        bounds = np.array([0, len(first_high), len(first_high) + len(second_high)], dtype=np.int64)
+        upper, lower = tl._donchian_bands_by_segment(
+            np.concatenate([first_high.to_numpy(), second_high.to_numpy()]),
+            np.concatenate([first_low.to_numpy(), second_low.to_numpy()]),
+            bounds, 2)
+        expected_upper = np.concatenate([first_high.rolling(2).max().to_numpy(), second_high.rolling(2).max().to_numpy()])
+        expected_lower = np.concatenate([first_low.rolling(2).min().to_numpy(), second_low.rolling(2).min().to_numpy()])
+        np.testing.assert_array_equal(upper, expected_upper)
+        np.testing.assert_array_equal(lower, expected_lower)
+
     def test_calculate_donchian_channel_invalid_input(self):
         with self.assertRaises(TypeError):
             tl.calculate_donchian_channel("not a series", self.low_series, 3)
@@ -114,6 +133,30 @@ class TestTradingLogic(unittest.TestCase):
         atr = tl.calculate_atr(high, low, close, period)
         assert_series_equal(atr, expected_atr, check_dtype=False)
 
+    def test_calculate_atr_wilder(self):
+        high = pd.Series([10, 12, 11, 13, 14, 12])
+        low = pd.Series(  [8,  9,  10, 10, 11, 10])
+        close = pd.Series([9,  11, 10, 12, 13, 11])
+        period = 3
+        seed = (3.0 + 1.0 + 3.0) / 3 # SMA of the first three True Range values
+        second = seed + (3.0 - seed) / period
+        third = second + (3.0 - second) / period
+        expected_atr = pd.Series([np.nan, np.nan, np.nan, seed, second, third])
+        atr = tl.calculate_atr(high, low, close, period, smoothing="wilder")
+        assert_series_equal(atr, expected_atr, check_dtype=False)
+        with self.assertRaises(ValueError):
+            tl.calculate_atr(high, low, close, period, smoothing="ema")
+
+    def test_atr_by_segment_matches_per_series(self):
+        first = (pd.Series([10, 12, 11, 13, 14], dtype=float), pd.Series([8, 9, 10, 10, 11], dtype=float), pd.Series([9, 11, 10, 12, 13], dtype=float))
+        second = (pd.Series([20, 21, 23, 22], dtype=float), pd.Series([18, 19, 20, 21], dtype=float), pd.Series([19, 20, 22, 21], dtype=float))
+        bounds = np.array([0, 5, 9], dtype=np.int64)
+        for smoothing in ("sma", "wilder"):
+            atr = tl._atr_by_segment(*(np.concatenate([a.to_numpy(), b.to_numpy()]) for a, b in zip(first, second)), bounds, 2, smoothing)
+            expected = np.concatenate([tl.calculate_atr(*first, 2, smoothing=smoothing).to_numpy(),
+                                       tl.calculate_atr(*second, 2, smoothing=smoothing).to_numpy()])
+            np.testing.assert_array_equal(atr, expected) # No window spans the boundary between series
+
     def test_calculate_atr_invalid_input(self):
         with self.assertRaises(TypeError):
             tl.calculate_atr("not series", self.low_series, self.close_series, 3)
@@ -150,12 +193,36 @@ class TestTradingLogic(unittest.TestCase):
         signals = tl.generate_entry_signals(close_prices, donchian_upper, donchian_lower, entry_period)
         assert_series_equal(signals, expected_signal, check_dtype=False)
 
+    def test_entry_signals_by_segment_matches_per_series(self):
+        first = (pd.Series([10, 12, 9, 13, 11], dtype=float), pd.Series([np.nan, 11, 11, 12, 12], dtype=float), pd.Series([np.nan, 9, 9, 9, 10], dtype=float))
+        second = (pd.Series([30, 20, 25, 26], dtype=float), pd.Series([11, 24, 25, 25], dtype=float), pd.Series([9, 22, 22, 23], dtype=float))
+        bounds = np.array([0, 5, 9], dtype=np.int64)
+        signals = tl._entry_signals_by_segment(*(np.concatenate([a.to_numpy(), b.to_numpy()]) for a, b in zip(first, second)), bounds)
+        expected = np.concatenate([tl.generate_entry_signals(*first, 2).to_numpy(), tl.generate_entry_signals(*second, 2).to_numpy()])
+        np.testing.assert_array_equal(signals, expected)
+        self.assertEqual(signals[5], 0) # 30 > 12 but the first bar of a series has no previous band
+
     def test_generate_entry_signals_input_validation(self):
         with self.assertRaises(TypeError):
             tl.generate_entry_signals("c", self.high_series, self.low_series, 3)
         with self.assertRaises(ValueError):
             tl.generate_entry_signals(self.close_series, self.high_series, self.low_series, 0)
 
+    def test_breakout_signals_entry_and_exit_in_one_pass(self):
+        close = np.array([10.0, 12.0, 7.0, 9.0])
+        upper = np.array([11.0, 12.5, 12.5, 12.0])
+        lower = np.array([8.0, 8.0, 7.5, 7.0])
+        positions = np.array([0.0, 0.0, 1.0, -1.0])
+        entry_signal, exit_signal = tl._breakout_signals(close, upper, lower, upper, lower, positions)
+        self.assertEqual(list(entry_signal), [0, 1, -1, 0])
+        self.assertEqual(list(exit_signal), [0, 0, -1, 0])
+
+    def test_generate_signals_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            tl.generate_entry_signals(pd.Series([1.0, 2.0]), pd.Series([1.0]), pd.Series([1.0]), 3)
+        with self.assertRaises(ValueError):
+            tl.generate_exit_signals(pd.Series([1.0, 2.0]), pd.Series([1.0, 2.0]), pd.Series([1.0, 2.0]), 3, 3, pd.Series([0]))
+
     # 4. Tests for generate_exit_signals (existing)
     def test_generate_exit_signals_long_exit(self):
         close_prices = pd.Series([15, 12, 10, 9, 8])
@@ -252,6 +319,31 @@ class TestTradingLogic(unittest.TestCase):
         self.assertEqual(order.commission, 0.0)
         self.assertEqual(order.slippage, 0.0)
 
+    def test_trade_log_columnar_storage(self):
+        log = tl.TradeLog(capacity=1)
+        t0 = datetime(2023, 1, 1)
+        log.record("1_A_ENTRY", "A", "buy", 1000, 1.1, t0, 0.5, 0.2, "entry")
+        log.record("1_A_ENTRY_sl", "A", "sell", 1000, 1.09, t0 + timedelta(hours=1), 0.5, 0.2, "exit", -10.5) # Grows the columns
+        log.append({"order_id": "2_B_ENTRY", "symbol": "B", "action": "sell", "quantity": 500, "price": 2.0,
+                    "timestamp": t0, "commission": 0.1, "slippage": 0.0, "realized_pnl": 1.0, "type": "reduction"})
+        self.assertEqual(len(log), 3)
+        self.assertEqual(log[0], {"order_id": "1_A_ENTRY", "symbol": "A", "action": "buy", "quantity": 1000.0, "price": 1.1,
+                                  "timestamp": t0, "commission": 0.5, "slippage": 0.2, "type": "entry"})
+        self.assertNotIn("realized_pnl", log[0])
+        self.assertEqual(log[1]["realized_pnl"], -10.5)
+        self.assertEqual(log[-1]["type"], "reduction")
+        self.assertEqual(log[1:], [log[1], log[2]])
+        self.assertEqual(log, list(log))
+        with self.assertRaises(IndexError):
+            log[3]
+        df = log.to_dataframe()
+        self.assertEqual(list(df["order_id"]), ["1_A_ENTRY", "1_A_ENTRY_sl", "2_B_ENTRY"])
+        self.assertEqual(list(df["action"]), ["buy", "sell", "sell"])
+        self.assertTrue(np.isnan(df["realized_pnl"].iloc[0]))
+        log.clear()
+        self.assertEqual(log, [])
+        self.assertFalse(log)
+
     # --- Tests for Position class ---
     def test_position_instantiation(self):
         position = Position(
@@ -330,6 +422,13 @@ class TestTradingLogic(unittest.TestCase):
         self.assertAlmostEqual(executed_order.commission, 0.0)
         self.assertAlmostEqual(executed_order.slippage, 0.0)
 
+    def test_execute_order_rejects_invalid_lot_size_untouched(self):
+        order = Order(order_id="mkt_buy_lot0", symbol=self.test_symbol, order_type="market", trade_action="buy", quantity=self.execute_order_lot_size)
+        with self.assertRaises(ValueError):
+            execute_order(order, self.market_price_buy, self.execute_order_slippage_pips, self.execute_order_commission_per_lot, self.execute_order_pip_point_value, 0, datetime.now())
+        self.assertEqual(order.status, "pending")
+        self.assertIsNone(order.fill_price) # Validation runs before any field is written
+
     # --- Tests for PortfolioManager (selected + uncommented) ---
     def test_pm_initialization(self):
         pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
@@ -389,6 +488,68 @@ class TestTradingLogic(unittest.TestCase):
         new_sl_order = next(o for o in pm.orders if o.order_id == position.active_stop_loss_order_id and o.status == "pending")
         self.assertEqual(new_sl_order.order_price, new_sl_price)
         self.assertEqual(new_sl_order.quantity, 15000)
+        original_sl_order = next(o for o in pm.orders if o.order_id == original_sl_order_id)
+        self.assertEqual(original_sl_order.status, "cancelled")
+        self.assertIs(pm.active_stops[self.test_symbol], new_sl_order)
+
+    def test_pm_active_stops_cleared_on_close(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_AS1", 0, 0)
+        self.assertEqual(pm.active_stops[self.test_symbol].order_id, "order_AS1_sl")
+        pm.close_position_completely(self.test_symbol, 1.1050, datetime.now(), "order_AS2", 0, 0)
+        self.assertEqual(pm.active_stops, {})
+        self.assertEqual(len(pm.orders), 1) # Stop order is kept for reporting
+        self.assertEqual(pm.stop_sides[pm.symbol_index[self.test_symbol]], 0)
+
+    def test_symbol_risk_params(self):
+        params = tl.SymbolRiskParams(pip_value_per_unit=0.0001, lot_size=100000, max_units=400000)
+        self.assertAlmostEqual(params.pip_value_per_lot, 10.0)
+        self.assertEqual(params.max_units, 400000)
+        with self.assertRaises(AttributeError):
+            params.unknown = 1 # __slots__: fixed attribute set
+
+    def test_find_stop_triggers(self):
+        lows = np.array([1.0890, 1.1000, np.nan, 1.2000])
+        highs = np.array([1.1010, 1.1310, np.nan, 1.2100])
+        stop_prices = np.array([1.0900, 1.1300, 1.0000, np.nan])
+        stop_sides = np.array([1, -1, 1, 0], dtype=np.int8) # Long, short, long without a bar, no stop
+        triggered = tl.find_stop_triggers(lows, highs, stop_prices, stop_sides)
+        self.assertEqual(list(triggered), [0, 1])
+
+    def test_find_next_event_bar(self):
+        entry_signals = np.array([[0, 0], [0, 1], [0, 0], [0, 0]], dtype=np.int8)
+        long_exits = np.array([[False, False], [False, False], [True, False], [False, False]])
+        short_exits = np.zeros((4, 2), dtype=bool)
+        lows = np.array([[1.10, 2.0], [1.10, 2.0], [1.10, 2.0], [1.08, 2.0]])
+        highs = lows + 0.01
+        flat = np.zeros(2)
+        no_stops = np.zeros(2, dtype=np.int8)
+        stop_prices = np.full(2, np.nan)
+        # Flat: only the entry signal in slot 1 matters, unless entries are disabled
+        self.assertEqual(tl.find_next_event_bar(0, entry_signals, long_exits, short_exits, lows, highs, flat, stop_prices, no_stops, True), 1)
+        self.assertEqual(tl.find_next_event_bar(0, entry_signals, long_exits, short_exits, lows, highs, flat, stop_prices, no_stops, False), 4)
+        # Long in slot 0 and in position for slot 1: the entry signal is ignored, the exit fires at bar 2
+        held = np.array([1000.0, 500.0])
+        self.assertEqual(tl.find_next_event_bar(0, entry_signals, long_exits, short_exits, lows, highs, held, stop_prices, no_stops, True), 2)
+        # From bar 3 on only the sell stop at 1.09 can trigger
+        stops = np.array([1, 0], dtype=np.int8)
+        self.assertEqual(tl.find_next_event_bar(3, entry_signals, long_exits, short_exits, lows, highs, held, np.array([1.09, np.nan]), stops, True), 3)
+        self.assertEqual(tl.find_next_event_bar(3, entry_signals, long_exits, short_exits, lows, highs, held, np.array([1.07, np.nan]), stops, True), 4)
+
+    def test_pm_position_arrays_mirror_positions(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        slot = pm.symbol_index[self.test_symbol]
+        pm.open_position(self.test_symbol, "sell", 10000, 1.1200, datetime.now(), 1.1300, "order_SOA1", 0, 0)
+        self.assertEqual(pm.position_quantities[slot], -10000)
+        self.assertAlmostEqual(pm.position_entry_prices[slot], 1.1200)
+        pm.reduce_position(self.test_symbol, 4000, 1.1100, datetime.now(), "order_SOA2", 0, 0)
+        self.assertEqual(pm.position_quantities[slot], -6000)
+        pm.close_position_completely(self.test_symbol, 1.1100, datetime.now(), "order_SOA3", 0, 0)
+        self.assertEqual(pm.position_quantities[slot], 0.0)
+        self.assertTrue(np.isnan(pm.position_entry_prices[slot]))
+
+        pm.open_position("OTHER/USD", "buy", 1000, 1.5, datetime.now(), 1.4, "order_SOA4", 0, 0) # Not in markets
+        self.assertEqual(pm.position_quantities[pm.symbol_index["OTHER/USD"]], 1000)
 
     def test_pm_close_long_position_completely(self):
         pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
@@ -403,6 +564,15 @@ class TestTradingLogic(unittest.TestCase):
         self.assertEqual(pm.trade_log[1]['type'], "exit")
         self.assertAlmostEqual(pm.trade_log[1]['realized_pnl'], ((exit_price - entry_price) * entry_qty) - exit_commission )
 
+    def test_pm_close_short_position_completely(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "sell", 10000, 1.1200, datetime.now(), 1.1300, "order_CS1", 2.0, 0)
+        pm.close_position_completely(self.test_symbol, 1.1250, datetime.now(), "order_CS2", 1.5, 0)
+        self.assertNotIn(self.test_symbol, pm.positions)
+        self.assertEqual(pm.trade_log[1]['action'], "buy")
+        self.assertEqual(pm.trade_log[1]['realized_pnl'], (1.1200 - 1.1250) * 10000 - 1.5) # Short loses when price rises
+        self.assertAlmostEqual(pm.capital, self.initial_capital - 2.0 + (1.1200 - 1.1250) * 10000 - 1.5)
+
     def test_pm_reduce_short_position(self):
         pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
         entry_qty_abs = 10000
@@ -429,6 +599,43 @@ class TestTradingLogic(unittest.TestCase):
         expected_unrealized_pnl = (1.10500 - entry_price) * entry_qty
         self.assertAlmostEqual(position.unrealized_pnl, expected_unrealized_pnl)
 
+    def test_pm_update_unrealized_pnl_unchanged_price_after_reduction(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_UPNL2", 0, 0)
+        current_prices = {self.test_symbol: 1.1050}
+        pm.update_unrealized_pnl(current_prices)
+        pm.update_unrealized_pnl(current_prices) # Unchanged price, P&L kept as is
+        self.assertAlmostEqual(pm.positions[self.test_symbol].unrealized_pnl, 50.0)
+        pm.reduce_position(self.test_symbol, 4000, 1.1050, datetime.now(), "order_UPNL3", 0, 0)
+        pm.update_unrealized_pnl(current_prices) # Same price, but the position changed
+        self.assertAlmostEqual(pm.positions[self.test_symbol].unrealized_pnl, 30.0)
+
+    def test_pm_capital_uses_compensated_summation(self):
+        pm = PortfolioManager(initial_capital=1e9, config=self.config)
+        cash_flows = [0.1, -0.07, 0.013] * 10000
+        for amount in cash_flows:
+            pm._add_to_capital(amount)
+        naive_capital = 1e9
+        for amount in cash_flows:
+            naive_capital += amount
+        exact_capital = fsum([1e9] + cash_flows)
+        self.assertEqual(pm.capital, exact_capital)
+        self.assertNotEqual(naive_capital, exact_capital) # Plain accumulation drifts
+        pm.capital = 500.0 # Assigning resets the compensation term
+        self.assertEqual(pm.capital, 500.0)
+
+    def test_pm_uses_simulated_timestamps(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        entry_time = datetime(2023, 1, 2, 9, 0)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, entry_time, 1.0900, "order_TS1", 0, 0)
+        self.assertEqual(pm.positions[self.test_symbol].last_update_timestamp, entry_time)
+        self.assertEqual(pm.active_stops[self.test_symbol].timestamp_created, entry_time)
+        bar_time = datetime(2023, 1, 2, 10, 0)
+        pm.update_unrealized_pnl({self.test_symbol: 1.1050}, timestamp=bar_time)
+        self.assertEqual(pm.positions[self.test_symbol].last_update_timestamp, bar_time)
+        order = Order(order_id="ts_order", symbol=self.test_symbol, order_type="market", trade_action="buy", quantity=100, timestamp_created=bar_time)
+        self.assertEqual(order.timestamp_created, bar_time)
+
     def test_pm_get_total_equity_simple(self):
         pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
         entry_qty = 10000; entry_price = 1.1000; entry_commission = 2.0
@@ -439,6 +646,50 @@ class TestTradingLogic(unittest.TestCase):
         total_equity = pm.get_total_equity(current_prices)
         self.assertAlmostEqual(total_equity, expected_equity)
 
+    def test_pm_get_total_equity_bar_epoch_cache(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_EQC1", 0, 0)
+        prices = {self.test_symbol: 1.1050}
+        equity = pm.get_total_equity(prices, bar_epoch=7)
+        self.assertAlmostEqual(equity, self.initial_capital + 50.0)
+        # Same bar, no position change: cached value is returned even for other prices
+        self.assertEqual(pm.get_total_equity({self.test_symbol: 1.2000}, bar_epoch=7), equity)
+        # Closing a position invalidates the cache within the same bar
+        pm.close_position_completely(self.test_symbol, 1.1050, datetime.now(), "order_EQC2", 0, 0)
+        self.assertAlmostEqual(pm.get_total_equity(prices, bar_epoch=7), self.initial_capital + 50.0)
+        self.assertAlmostEqual(pm.get_total_equity({}, bar_epoch=8), pm.capital)
+
+    def test_pm_get_total_equity_cache_invalidated_by_capital_assignment(self):
+        pm = PortfolioManager(initial_capital=1000.0, config=self.config)
+        self.assertEqual(pm.get_total_equity({self.test_symbol: 1.0}, bar_epoch=5), 1000.0)
+        pm.capital = 500.0
+        self.assertEqual(pm.get_total_equity({self.test_symbol: 1.0}, bar_epoch=5), 500.0)
+        self.assertEqual(pm.get_total_equity_at(np.array([1.0]), bar_epoch=6), 500.0)
+        pm.capital = 200.0
+        self.assertEqual(pm.get_total_equity_at(np.array([1.0]), bar_epoch=6), 200.0)
+
+    def test_pm_get_total_equity_for_bars(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        np.testing.assert_array_equal(pm.get_total_equity_for_bars(np.array([[1.1], [1.2]])), [pm.capital, pm.capital])
+        pm.open_position(self.test_symbol, "sell", 10000, 1.1000, datetime.now(), 1.1100, "order_EQB1", 0, 0)
+        prices = np.array([[1.0950], [np.nan], [1.1020]]) # No bar for the symbol at the second row
+        equity = pm.get_total_equity_for_bars(prices)
+        for row, price in enumerate([1.0950, None, 1.1020]):
+            current_prices = {} if price is None else {self.test_symbol: price}
+            self.assertAlmostEqual(equity[row], pm.get_total_equity(current_prices))
+
+    def test_pm_get_total_equity_at(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        self.assertEqual(pm.get_total_equity_at(np.array([1.1])), pm.capital)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_EQA1", 0, 0)
+        self.assertAlmostEqual(pm.get_total_equity_at(np.array([1.1050])), pm.get_total_equity({self.test_symbol: 1.1050}))
+        self.assertAlmostEqual(pm.get_total_equity_at(np.array([np.nan])), pm.capital) # No price: no P&L counted
+
+        first = pm.get_total_equity_at(np.array([1.1050]), bar_epoch=3)
+        self.assertEqual(pm.get_total_equity_at(np.array([1.2000]), bar_epoch=3), first) # Same bar, no changes: cached
+        pm.close_position_completely(self.test_symbol, 1.1050, datetime.now(), "order_EQA1_close", 0, 0)
+        self.assertEqual(pm.get_total_equity_at(np.array([1.1050]), bar_epoch=3), pm.capital) # Close invalidates the cache
+
     def test_pm_get_current_total_open_risk_percentage(self):
         pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
         entry_price1 = 1.10000; sl_price1 = 1.09000; qty1 = 10000; entry_commission = 0.0
@@ -456,6 +707,48 @@ class TestTradingLogic(unittest.TestCase):
         pm_zero_cap_zero_risk = PortfolioManager(initial_capital=0, config=self.config)
         self.assertEqual(pm_zero_cap_zero_risk.get_current_total_open_risk_percentage(), 0.0)
 
+    def test_pm_open_risk_uses_per_slot_pip_values(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        np.testing.assert_array_equal(pm.pip_values, [self.pip_point_value_per_unit])
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_PV1", 0, 0)
+        pm.open_position("UNCONFIGURED/USD", "buy", 10000, 1.2000, datetime.now(), 1.1000, "order_PV2", 0, 0) # Outside `markets`, no pip value
+        self.assertEqual(len(pm.pip_values), 2)
+        self.assertTrue(np.isnan(pm.pip_values[1]))
+        with self.assertLogs('trading_logic', level='WARNING') as captured:
+            risk = pm.get_current_total_open_risk_percentage()
+        self.assertIn("UNCONFIGURED/USD", captured.output[0])
+        self.assertAlmostEqual(risk, (1.1000 - 1.0900) * 10000 * self.pip_point_value_per_unit / pm.capital) # Unpriced position adds no risk
+
+    def test_pm_open_risk_short_and_profitable_stop(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "sell", 10000, 1.1000, datetime.now(), 1.1100, "order_RSK_S", 0, 0)
+        expected_risk = (1.1100 - 1.1000) * 10000 * self.config['pip_point_value'][self.test_symbol]
+        self.assertAlmostEqual(pm.get_current_total_open_risk_percentage(), expected_risk / pm.capital, places=9)
+
+        pm_locked = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm_locked.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.1050, "order_RSK_L", 0, 0)
+        self.assertEqual(pm_locked.get_current_total_open_risk_percentage(), 0.0) # Stop above entry locks in profit
+
+    def test_pm_open_risk_is_cached_until_positions_change(self):
+        pm = PortfolioManager(initial_capital=self.initial_capital, config=self.config)
+        pm.open_position(self.test_symbol, "buy", 10000, 1.1000, datetime.now(), 1.0900, "order_RC1", 0, 0)
+        pip_value = self.pip_point_value_per_unit
+        first_risk = pm.get_current_total_open_risk_percentage()
+        self.assertAlmostEqual(first_risk, (1.1000 - 1.0900) * 10000 * pip_value / pm.capital)
+        version = pm._risk_version
+        self.assertEqual(pm.get_current_total_open_risk_percentage(), first_risk)
+        self.assertEqual(pm._cached_risk_version, version) # Served from the cache
+
+        pm.capital = self.initial_capital / 2 # Capital is applied at read time, not cached
+        self.assertAlmostEqual(pm.get_current_total_open_risk_percentage(), 2 * first_risk)
+
+        pm.reduce_position(self.test_symbol, 5000, 1.1050, datetime.now(), "order_RC2", 0, 0)
+        self.assertNotEqual(pm._risk_version, version)
+        self.assertAlmostEqual(pm.get_current_total_open_risk_percentage(), (1.1000 - 1.0900) * 5000 * pip_value / pm.capital)
+
+        pm.close_position_completely(self.test_symbol, 1.1050, datetime.now(), "order_RC3", 0, 0)
+        self.assertEqual(pm.get_current_total_open_risk_percentage(), 0.0)
+
     # --- Risk Management Tests ---
     def test_risk_man_position_sizing_basic(self):
         units = calculate_position_size(account_equity=100000, risk_percentage=0.01, atr=20, pip_value_per_lot=10, lot_size=100000, max_units_per_market=1000000, current_units_for_market=0, total_risk_percentage_limit=0.05, current_total_open_risk_percentage=0.0)
@@ -472,6 +765,10 @@ class TestTradingLogic(unittest.TestCase):
         units = calculate_position_size(account_equity=100000, risk_percentage=0.01, atr=20, pip_value_per_lot=10, lot_size=100000, max_units_per_market=max_units, current_units_for_market=current_units, total_risk_percentage_limit=0.05, current_total_open_risk_percentage=0.0)
         self.assertEqual(units, 100000)
 
+    def test_risk_man_position_sizing_market_already_full(self):
+        units = calculate_position_size(account_equity=100000, risk_percentage=0.01, atr=20, pip_value_per_lot=10, lot_size=100000, max_units_per_market=300000, current_units_for_market=300000, total_risk_percentage_limit=0.05, current_total_open_risk_percentage=0.0)
+        self.assertEqual(units, 0)
+
     def test_risk_man_position_sizing_hits_total_risk_limit(self):
         units = calculate_position_size(account_equity=100000, risk_percentage=0.01, atr=20, pip_value_per_lot=10, lot_size=100000, max_units_per_market=1000000, current_units_for_market=0, total_risk_percentage_limit=0.05, current_total_open_risk_percentage=0.045)
         self.assertEqual(units, 125000)
@@ -513,6 +810,171 @@ class TestTradingLogic(unittest.TestCase):
         self.assertTrue(len(results['equity_curve']) == len(timestamps))
         self.assertLess(results['final_capital'], test_config['initial_capital'])
 
+    def test_run_strategy_rejects_non_positive_stop_multiplier(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(6)]
+        hist_df = pd.DataFrame({'Open': 1.1, 'High': 1.101, 'Low': 1.099, 'Close': 1.1}, index=pd.DatetimeIndex(timestamps))
+        test_config = self.config.copy()
+        test_config['stop_loss_atr_multiplier'] = 0
+        with self.assertRaises(ValueError):
+            run_strategy({self.test_symbol: hist_df}, test_config['initial_capital'], test_config)
+
+
+    def test_run_strategy_tiled_matches_untiled(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(10)]
+        data = {'Open':  [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.090, 1.088], 'High':  [1.101, 1.102, 1.103, 1.104, 1.105, 1.108, 1.107, 1.103, 1.095, 1.090], 'Low':   [1.099, 1.100, 1.101, 1.102, 1.103, 1.100, 1.101, 1.088, 1.085, 1.086], 'Close': [1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.089, 1.088, 1.087]}
+        historical_data_dict = {self.test_symbol: pd.DataFrame(data, index=pd.DatetimeIndex(timestamps))}
+        test_config = self.config.copy()
+        test_config['atr_period'] = 5
+        test_config['stop_loss_atr_multiplier'] = 1.5
+        untiled = run_strategy(historical_data_dict, test_config['initial_capital'], test_config)
+        self.assertTrue(len(untiled['trade_log']) >= 2)
+        for tile_size in (1, 3, 7):
+            tiled = run_strategy(historical_data_dict, test_config['initial_capital'], dict(test_config, backtest_tile_size=tile_size))
+            self.assertEqual(tiled['trade_log'], untiled['trade_log'])
+            self.assertEqual(tiled['equity_curve'], untiled['equity_curve'])
+        with self.assertRaises(ValueError):
+            run_strategy(historical_data_dict, test_config['initial_capital'], dict(test_config, backtest_tile_size=0))
+
+    def test_run_strategy_without_trade_log(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(10)]
+        data = {'Open':  [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.090, 1.088], 'High':  [1.101, 1.102, 1.103, 1.104, 1.105, 1.108, 1.107, 1.103, 1.095, 1.090], 'Low':   [1.099, 1.100, 1.101, 1.102, 1.103, 1.100, 1.101, 1.088, 1.085, 1.086], 'Close': [1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.089, 1.088, 1.087]}
+        historical_data_dict = {self.test_symbol: pd.DataFrame(data, index=pd.DatetimeIndex(timestamps))}
+        test_config = self.config.copy()
+        test_config['atr_period'] = 5
+        test_config['stop_loss_atr_multiplier'] = 1.5
+        logged = run_strategy(historical_data_dict, test_config['initial_capital'], test_config)
+        unlogged = run_strategy(historical_data_dict, test_config['initial_capital'], dict(test_config, enable_trade_log=False))
+        self.assertEqual(unlogged['trade_log'], [])
+        self.assertEqual(unlogged['portfolio_summary']['total_trades'], len(logged['trade_log']))
+        self.assertEqual(unlogged['equity_curve'], logged['equity_curve'])
+        self.assertEqual(unlogged['final_capital'], logged['final_capital'])
+
+    def test_run_strategy_fp32_indicators(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(10)]
+        data = {'Open':  [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.090, 1.088], 'High':  [1.101, 1.102, 1.103, 1.104, 1.105, 1.108, 1.107, 1.103, 1.095, 1.090], 'Low':   [1.099, 1.100, 1.101, 1.102, 1.103, 1.100, 1.101, 1.088, 1.085, 1.086], 'Close': [1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.089, 1.088, 1.087]}
+        historical_data_dict = {self.test_symbol: pd.DataFrame(data, index=pd.DatetimeIndex(timestamps))}
+        test_config = self.config.copy()
+        test_config['atr_period'] = 5
+        test_config['stop_loss_atr_multiplier'] = 1.5
+        fp64 = run_strategy(historical_data_dict, test_config['initial_capital'], test_config)
+        fp32 = run_strategy(historical_data_dict, test_config['initial_capital'], dict(test_config, use_fp32_indicators=True))
+        self.assertEqual([t['order_id'] for t in fp32['trade_log']], [t['order_id'] for t in fp64['trade_log']])
+        for trade_32, trade_64 in zip(fp32['trade_log'], fp64['trade_log']):
+            self.assertIsInstance(trade_32['price'], float)
+            self.assertAlmostEqual(trade_32['price'], trade_64['price'], places=5)
+            self.assertEqual(trade_32['quantity'], trade_64['quantity']) # Sizing reads the float64 ATR
+        self.assertAlmostEqual(fp32['final_capital'], fp64['final_capital'], places=2)
+
+    def test_run_strategy_streams_results_to_csv(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(10)]
+        data = {'Open':  [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.090, 1.088], 'High':  [1.101, 1.102, 1.103, 1.104, 1.105, 1.108, 1.107, 1.103, 1.095, 1.090], 'Low':   [1.099, 1.100, 1.101, 1.102, 1.103, 1.100, 1.101, 1.088, 1.085, 1.086], 'Close': [1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.089, 1.088, 1.087]}
+        historical_data_dict = {self.test_symbol: pd.DataFrame(data, index=pd.DatetimeIndex(timestamps))}
+        test_config = self.config.copy()
+        test_config['atr_period'] = 5
+        test_config['stop_loss_atr_multiplier'] = 1.5
+        in_memory = run_strategy(historical_data_dict, test_config['initial_capital'], test_config)
+        with tempfile.TemporaryDirectory() as stream_dir:
+            streamed = run_strategy(historical_data_dict, test_config['initial_capital'],
+                                    dict(test_config, backtest_tile_size=4, results_stream_dir=stream_dir))
+            self.assertEqual(streamed['equity_curve'], [])
+            self.assertEqual(streamed['trade_log'], [])
+            self.assertEqual(streamed['equity_curve_path'], os.path.join(stream_dir, "equity_curve.csv"))
+            equity_df = pd.read_csv(streamed['equity_curve_path'], parse_dates=['timestamp'])
+            trade_df = pd.read_csv(streamed['trade_log_path'], parse_dates=['timestamp'])
+        self.assertEqual(list(equity_df['timestamp']), [ts for ts, _ in in_memory['equity_curve']])
+        np.testing.assert_allclose(equity_df['equity'], [eq for _, eq in in_memory['equity_curve']])
+        self.assertEqual(list(trade_df['order_id']), [t['order_id'] for t in in_memory['trade_log']])
+        # The last tile is partial and reuses the tile-sized equity buffer
+        self.assertEqual(streamed['portfolio_summary']['final_equity'], in_memory['portfolio_summary']['final_equity'])
+        self.assertEqual(streamed['portfolio_summary']['total_trades'], len(in_memory['trade_log']))
+        self.assertAlmostEqual(streamed['final_capital'], in_memory['final_capital'])
+
+    def test_run_strategy_warns_once_for_missing_symbol_config(self):
+        timestamps = [datetime(2023, 1, 1) + timedelta(hours=i) for i in range(12)]
+        closes = [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.107, 1.108, 1.109, 1.110, 1.111] # Breaks out on every bar
+        hist_df = pd.DataFrame({'Open': closes, 'High': [c + 0.0005 for c in closes], 'Low': [c - 0.0005 for c in closes], 'Close': closes}, index=pd.DatetimeIndex(timestamps))
+        test_config = self.config.copy()
+        test_config['atr_period'] = 3
+        test_config['entry_donchian_period'] = 3
+        test_config['lot_size'] = {} # No lot size configured for the traded market
+        with self.assertLogs('trading_logic', level='WARNING') as captured:
+            results = run_strategy({self.test_symbol: hist_df}, test_config['initial_capital'], test_config)
+        self.assertEqual(results['trade_log'], [])
+        self.assertEqual(sum("Missing symbol-specific config" in line for line in captured.output), 1)
+
+    def _trading_fixture(self):
+        # Hourly bars on which the default config (with atr_period=5) opens, stops out and reopens a long
+        timestamps = pd.DatetimeIndex([datetime(2023, 1, 1) + timedelta(hours=i) for i in range(10)])
+        data = {'Open':  [1.100, 1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.090, 1.088], 'High':  [1.101, 1.102, 1.103, 1.104, 1.105, 1.108, 1.107, 1.103, 1.095, 1.090], 'Low':   [1.099, 1.100, 1.101, 1.102, 1.103, 1.100, 1.101, 1.088, 1.085, 1.086], 'Close': [1.101, 1.102, 1.103, 1.104, 1.105, 1.106, 1.102, 1.089, 1.088, 1.087]}
+        return pd.DataFrame(data, index=timestamps)
+
+    def test_run_strategy_parallel_combines_subsets(self):
+        other_symbol = "OTHER/USD"
+        hist_a = self._trading_fixture()
+        # Mirror image of hist_a (trades short first), offset by half an hour so the timelines interleave
+        mirrored = 2.2 - hist_a.to_numpy()
+        hist_b = pd.DataFrame({'Open': mirrored[:, 0], 'High': mirrored[:, 2], 'Low': mirrored[:, 1], 'Close': mirrored[:, 3]},
+                              index=hist_a.index + timedelta(minutes=30))
+        test_config = dict(self.config, atr_period=5)
+        for key in ('pip_point_value', 'lot_size', 'max_units_per_market'):
+            test_config[key] = dict(test_config[key], **{other_symbol: test_config[key][self.test_symbol]})
+        test_config['markets'] = [self.test_symbol, other_symbol]
+        historical_data_dict = {self.test_symbol: hist_a, other_symbol: hist_b}
+
+        results = tl.run_strategy_parallel(historical_data_dict, 100000.0, test_config, max_workers=2)
+        result_a = run_strategy({self.test_symbol: hist_a}, 50000.0, dict(test_config, markets=[self.test_symbol]))
+        result_b = run_strategy({other_symbol: hist_b}, 50000.0, dict(test_config, markets=[other_symbol]))
+
+        self.assertGreater(len(result_a['trade_log']), 0)
+        self.assertGreater(len(result_b['trade_log']), 0)
+        self.assertEqual(results['portfolio_summary']['subsets'], [[self.test_symbol], [other_symbol]])
+        self.assertEqual(results['portfolio_summary']['total_trades'],
+                         result_a['portfolio_summary']['total_trades'] + result_b['portfolio_summary']['total_trades'])
+        self.assertIsInstance(results['trade_log'], tl.TradeLog)
+        self.assertEqual(results['trade_log'], sorted(list(result_a['trade_log']) + list(result_b['trade_log']),
+                                                      key=lambda trade: trade['timestamp']))
+        self.assertAlmostEqual(results['final_capital'], result_a['final_capital'] + result_b['final_capital'])
+        self.assertNotAlmostEqual(results['final_capital'], 100000.0)
+        self.assertEqual(len(results['equity_curve']), 20)
+        self.assertAlmostEqual(results['equity_curve'][0][1], result_a['equity_curve'][0][1] + 50000.0) # hist_b has no bar yet
+        self.assertAlmostEqual(results['equity_curve'][1][1], result_a['equity_curve'][0][1] + result_b['equity_curve'][0][1])
+        self.assertAlmostEqual(results['portfolio_summary']['final_equity'],
+                               result_a['portfolio_summary']['final_equity'] + result_b['portfolio_summary']['final_equity'])
+
+        single = tl.run_strategy_parallel({self.test_symbol: hist_a}, 100000.0, dict(test_config, markets=[self.test_symbol]))
+        self.assertEqual(single['trade_log'], run_strategy({self.test_symbol: hist_a}, 100000.0, dict(test_config, markets=[self.test_symbol]))['trade_log'])
+
+    def test_run_strategy_parallel_subset_without_data(self):
+        other_symbol = "OTHER/USD"
+        hist_a = self._trading_fixture()
+        test_config = dict(self.config, atr_period=5, markets=[self.test_symbol, other_symbol])
+
+        results = tl.run_strategy_parallel({self.test_symbol: hist_a}, 100000.0, test_config, max_workers=2)
+        result_a = run_strategy({self.test_symbol: hist_a}, 50000.0, dict(test_config, markets=[self.test_symbol]))
+
+        self.assertEqual(results['trade_log'], result_a['trade_log'])
+        self.assertEqual(results['portfolio_summary']['total_trades'], result_a['portfolio_summary']['total_trades'])
+        self.assertAlmostEqual(results['final_capital'], result_a['final_capital'] + 50000.0)
+        self.assertEqual([equity for _, equity in results['equity_curve']],
+                         [equity + 50000.0 for _, equity in result_a['equity_curve']])
+
+    def test_run_strategies_matches_sequential_runs(self):
+        hist = self._trading_fixture()
+        # The stop distance sets where the first long is stopped out, so each config ends differently
+        configs = [dict(self.config, atr_period=5, stop_loss_atr_multiplier=multiplier) for multiplier in (1.0, 2.0, 3.0)]
+
+        results = tl.run_strategies({self.test_symbol: hist}, 100000.0, configs, max_workers=2)
+
+        self.assertEqual(len(results), len(configs))
+        self.assertEqual(len({result['final_capital'] for result in results}), len(configs))
+        for config, result in zip(configs, results): # Same order as `configs`
+            expected = run_strategy({self.test_symbol: hist}, 100000.0, config)
+            self.assertGreater(len(expected['trade_log']), 0)
+            self.assertEqual(result['final_capital'], expected['final_capital'])
+            self.assertEqual(result['equity_curve'], expected['equity_curve'])
+            self.assertEqual(result['trade_log'], expected['trade_log'])
+        with self.assertRaises(ValueError):
+            tl.run_strategies({self.test_symbol: hist}, 100000.0, [dict(config, results_stream_dir="out") for config in configs])
 
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
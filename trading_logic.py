@@ -1,7 +1,26 @@
 import pandas as pd
-import math
+import numpy as np
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Union, Optional, List, Dict, Tuple, Any
+from logger import get_logger
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError: # Numba is optional; the kernels below then run as plain Python
+    NUMBA_AVAILABLE = False
+    prange = range
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+trading_logger = get_logger(__name__)
 
 class Order:
     """
@@ -10,10 +29,15 @@ class Order:
     An order can be for entry or exit, market or pending (stop/limit).
     It holds all information related to a specific trade instruction.
     """
+    # Fixed attribute set: no per-instance __dict__, and attribute reads hit a slot directly
+    __slots__ = ('order_id', 'symbol', 'order_type', 'trade_action', 'quantity', 'order_price', 'status',
+                 'fill_price', 'timestamp_created', 'timestamp_filled', 'commission', 'slippage')
+
     def __init__(self, order_id: str, symbol: str, order_type: str, trade_action: str,
                  quantity: float, order_price: Optional[float] = None, status: str = "pending",
                  fill_price: Optional[float] = None, commission: float = 0.0, slippage: float = 0.0,
-                 timestamp_filled: Optional[datetime] = None): # Added timestamp_filled to signature
+                 timestamp_filled: Optional[datetime] = None, # Added timestamp_filled to signature
+                 timestamp_created: Optional[datetime] = None):
         """
         Initializes an Order object.
 
@@ -32,6 +56,9 @@ class Order:
             commission (float, optional): Commission incurred for this order. Defaults to 0.0.
             slippage (float, optional): Monetary value of slippage incurred for this order. Defaults to 0.0.
             timestamp_filled (Optional[datetime], optional): Time when the order was filled. Defaults to None.
+            timestamp_created (Optional[datetime], optional): Time the order was created, e.g. the
+                                                     simulated bar time in a backtest. Defaults to
+                                                     None (wall-clock time).
         """
         self.order_id = order_id
         self.symbol = symbol
@@ -41,7 +68,7 @@ class Order:
         self.order_price = order_price  # Specified price for stop or limit orders
         self.status = status  # Current state: "pending", "filled", "cancelled"
         self.fill_price = fill_price  # Actual execution price after filling
-        self.timestamp_created = datetime.now()  # Time when the order object was created
+        self.timestamp_created = timestamp_created if timestamp_created is not None else datetime.now()  # Time when the order object was created
         self.timestamp_filled = timestamp_filled  # Time when the order was successfully filled
         self.commission = commission  # Commission fee for this order
         self.slippage = slippage  # Monetary value of slippage for this order
@@ -53,9 +80,14 @@ class Position:
     It tracks the quantity, average entry price, stop-loss levels,
     take-profit levels (if any), and P&L for an open trade.
     """
+    __slots__ = ('symbol', 'quantity', 'average_entry_price', 'initial_stop_loss_price', 'current_stop_loss_price',
+                 'take_profit_price', 'unrealized_pnl', 'realized_pnl', 'last_update_timestamp',
+                 'related_entry_order_id', 'active_stop_loss_order_id')
+
     def __init__(self, symbol: str, quantity: float, average_entry_price: float,
                  related_entry_order_id: str, initial_stop_loss_price: Optional[float] = None,
-                 current_stop_loss_price: Optional[float] = None, take_profit_price: Optional[float] = None):
+                 current_stop_loss_price: Optional[float] = None, take_profit_price: Optional[float] = None,
+                 last_update_timestamp: Optional[datetime] = None):
         """
         Initializes a Position object.
 
@@ -72,6 +104,9 @@ class Position:
             take_profit_price (Optional[float], optional): The take-profit price for this position.
                                                  (Note: Current strategy uses Donchian exits, not fixed TP orders).
                                                  Defaults to None.
+            last_update_timestamp (Optional[datetime], optional): Time the position was opened, e.g. the
+                                                        simulated bar time in a backtest. Defaults to
+                                                        None (wall-clock time).
         """
         self.symbol = symbol
         self.quantity = quantity  # Positive for long positions, negative for short positions
@@ -81,10 +116,169 @@ class Position:
         self.take_profit_price = take_profit_price  # May not be used if strategy relies on dynamic exits
         self.unrealized_pnl: Optional[float] = 0.0  # Profit or loss if the position were closed at current market prices
         self.realized_pnl: float = 0.0  # Profit or loss accumulated from partially or fully closing this position
-        self.last_update_timestamp: datetime = datetime.now()  # Timestamp of the last modification or P&L update
+        self.last_update_timestamp: datetime = last_update_timestamp if last_update_timestamp is not None else datetime.now()  # Timestamp of the last modification or P&L update
         self.related_entry_order_id: str = related_entry_order_id # ID of the order that opened/last significantly modified this position
         self.active_stop_loss_order_id: Optional[str] = None  # ID of the currently active stop-loss order linked to this position
 
+class TradeLog:
+    """
+    Log of executed trades, stored column by column and read back as trade dictionaries.
+
+    Numeric fields (quantity, price, commission, slippage, realized P&L) live in one growable
+    float64 array per field and action/type as small integer codes, instead of one dict per
+    trade. Reading (indexing, iteration, `==` against a list) yields the same dicts
+    `PortfolioManager` used to append, with numeric fields as floats; "realized_pnl" is only
+    present for exits and reductions. `to_dataframe()` returns all trades as one DataFrame.
+    """
+    __slots__ = ('_order_ids', '_symbols', '_timestamps', '_action_codes', '_type_codes',
+                 '_numeric', '_has_realized_pnl', '_length')
+
+    ACTIONS = ("buy", "sell")
+    TYPES = ("entry", "exit", "reduction")
+    NUMERIC_FIELDS = ("quantity", "price", "commission", "slippage", "realized_pnl")
+    _ACTION_CODES = {name: code for code, name in enumerate(ACTIONS)}
+    _TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+    def __init__(self, capacity: int = 64):
+        """
+        Initializes an empty TradeLog.
+
+        Args:
+            capacity (int, optional): Initial number of trades the numeric columns can hold
+                                      before they are grown (doubled). Defaults to 64.
+        """
+        self._order_ids: list = []
+        self._symbols: list = []
+        self._timestamps: list = []
+        self._action_codes = np.empty(capacity, dtype=np.int8)
+        self._type_codes = np.empty(capacity, dtype=np.int8)
+        self._numeric = np.empty((len(self.NUMERIC_FIELDS), capacity), dtype=np.float64) # One row per field
+        self._has_realized_pnl = np.empty(capacity, dtype=np.bool_)
+        self._length = 0
+
+    def record(self, order_id: str, symbol: str, action: str, quantity: float, price: float,
+               timestamp, commission: float, slippage: float, trade_type: str,
+               realized_pnl: Optional[float] = None):
+        """Appends one executed trade (`trade_type` is "entry", "exit" or "reduction")."""
+        n = self._length
+        if n == self._action_codes.shape[0]: # Full: double every column's capacity
+            capacity = max(2 * n, 1)
+            self._action_codes = np.resize(self._action_codes, capacity)
+            self._type_codes = np.resize(self._type_codes, capacity)
+            self._has_realized_pnl = np.resize(self._has_realized_pnl, capacity)
+            numeric = np.empty((len(self.NUMERIC_FIELDS), capacity), dtype=np.float64)
+            numeric[:, :n] = self._numeric[:, :n]
+            self._numeric = numeric
+        self._order_ids.append(order_id)
+        self._symbols.append(symbol)
+        self._timestamps.append(timestamp)
+        self._action_codes[n] = self._ACTION_CODES[action]
+        self._type_codes[n] = self._TYPE_CODES[trade_type]
+        self._has_realized_pnl[n] = realized_pnl is not None
+        numeric = self._numeric
+        numeric[0, n] = quantity
+        numeric[1, n] = price
+        numeric[2, n] = commission
+        numeric[3, n] = slippage
+        numeric[4, n] = np.nan if realized_pnl is None else realized_pnl
+        self._length = n + 1
+
+    def append(self, trade: Dict[str, Any]):
+        """Appends a trade given as a dict with the trade log keys (as produced by iteration)."""
+        self.record(trade["order_id"], trade["symbol"], trade["action"], trade["quantity"], trade["price"],
+                    trade["timestamp"], trade["commission"], trade["slippage"], trade["type"],
+                    trade.get("realized_pnl"))
+
+    def clear(self):
+        """Removes all trades (the allocated column capacity is kept)."""
+        self._order_ids.clear()
+        self._symbols.clear()
+        self._timestamps.clear()
+        self._length = 0
+
+    def _trade(self, i: int) -> Dict[str, Any]:
+        numeric = self._numeric
+        trade = {
+            "order_id": self._order_ids[i],
+            "symbol": self._symbols[i],
+            "action": self.ACTIONS[self._action_codes[i]],
+            "quantity": float(numeric[0, i]),
+            "price": float(numeric[1, i]),
+            "timestamp": self._timestamps[i],
+            "commission": float(numeric[2, i]),
+            "slippage": float(numeric[3, i]),
+        }
+        if self._has_realized_pnl[i]:
+            trade["realized_pnl"] = float(numeric[4, i])
+        trade["type"] = self.TYPES[self._type_codes[i]]
+        return trade
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._trade(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("trade log index out of range")
+        return self._trade(index)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self._trade(i)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (TradeLog, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None # Mutable container
+
+    def __repr__(self) -> str:
+        return f"TradeLog({list(self)!r})"
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the trades as a DataFrame (realized_pnl is NaN for entries)."""
+        n = self._length
+        columns = {
+            "order_id": self._order_ids[:n],
+            "symbol": self._symbols[:n],
+            "action": np.asarray(self.ACTIONS, dtype=object)[self._action_codes[:n]],
+            "timestamp": self._timestamps[:n],
+            "type": np.asarray(self.TYPES, dtype=object)[self._type_codes[:n]],
+        }
+        for row, field in enumerate(self.NUMERIC_FIELDS):
+            columns[field] = self._numeric[row, :n].copy()
+        return pd.DataFrame(columns, columns=["order_id", "symbol", "action", "quantity", "price", "timestamp",
+                                              "commission", "slippage", "realized_pnl", "type"])
+
+class SymbolRiskParams:
+    """
+    Per-symbol sizing and execution parameters, resolved from the config once per backtest.
+    """
+    __slots__ = ('pip_value_per_unit', 'lot_size', 'pip_value_per_lot', 'max_units')
+
+    def __init__(self, pip_value_per_unit: float, lot_size: int, max_units: int):
+        """
+        Initializes a SymbolRiskParams object.
+
+        Args:
+            pip_value_per_unit (float): Monetary value of one pip/point move for a single unit.
+            lot_size (int): Number of units in one standard lot.
+            max_units (int): Maximum units allowed for the symbol.
+        """
+        self.pip_value_per_unit = pip_value_per_unit
+        self.lot_size = lot_size
+        self.pip_value_per_lot = pip_value_per_unit * lot_size
+        self.max_units = max_units
+
+# Dispatch tables for `execute_order`: the price a fill starts from per order type, and the
+# direction adverse slippage moves it per trade action.
+_FILL_PRICE_SOURCES = {"market": "market_price", "stop": "order_price"}
+_SLIPPAGE_SIGNS = {"buy": 1.0, "sell": -1.0}
+
 def execute_order(order: Order, current_market_price: float, slippage_pips: float,
                   commission_per_lot: float, pip_point_value: float, lot_size: int,
                   timestamp_filled_param: datetime) -> Order:
@@ -122,36 +316,26 @@ def execute_order(order: Order, current_market_price: float, slippage_pips: floa
         # If the order is not pending (e.g., already filled or cancelled), no action is taken.
         return order
 
+    # Validate everything up front, so a rejected order is left untouched
+    price_source = _FILL_PRICE_SOURCES.get(order.order_type)
+    if price_source is None:
+        raise ValueError(f"Unsupported order type: {order.order_type}")
+    slippage_sign = _SLIPPAGE_SIGNS.get(order.trade_action)
+    if slippage_sign is None:
+        raise ValueError(f"Invalid trade action for {order.order_type} order: {order.trade_action}")
+    if lot_size <= 0:
+        raise ValueError("Lot size must be positive to calculate commission.")
+
     # Calculate total monetary slippage: slippage per point * number of points for one unit
     slippage_amount = slippage_pips * pip_point_value
 
-    # Determine fill price based on order type and trade action
-    if order.order_type == "market":
-        # Market orders fill based on current_market_price, adjusted by slippage.
-        if order.trade_action == "buy":
-            order.fill_price = current_market_price + slippage_amount
-        elif order.trade_action == "sell":
-            order.fill_price = current_market_price - slippage_amount
-        else:
-            raise ValueError(f"Invalid trade action for market order: {order.trade_action}")
-    elif order.order_type == "stop":
-        # Stop orders trigger at order_price. Fill price is order_price adjusted by slippage.
-        # The 'current_market_price' argument for a stop order should be its trigger price (order.order_price).
-        if order.trade_action == "sell":  # Stop-loss for a long position, or a sell-stop entry
-            order.fill_price = order.order_price - slippage_amount # Sells at or below stop price
-        elif order.trade_action == "buy":  # Stop-loss for a short position, or a buy-stop entry
-            order.fill_price = order.order_price + slippage_amount # Buys at or above stop price
-        else:
-            raise ValueError(f"Invalid trade action for stop order: {order.trade_action}")
-    # elif order.order_type == "limit":
-    #     # Placeholder for limit order logic (ensure fill is at order_price or better)
-    #     pass
-    else:
-        raise ValueError(f"Unsupported order type: {order.order_type}")
+    # Determine fill price: the base price depends on the order type, and slippage always works
+    # against the trader (buys fill higher, sells lower), so its sign depends only on the action.
+    # Market orders fill from current_market_price; stop orders trigger (and fill) at order_price.
+    base_price = current_market_price if price_source == "market_price" else order.order_price
+    order.fill_price = base_price + slippage_sign * slippage_amount
 
     # Calculate commission
-    if lot_size <= 0:
-        raise ValueError("Lot size must be positive to calculate commission.")
     order.commission = (order.quantity / lot_size) * commission_per_lot
 
     # Store the monetary value of slippage applied to this order
@@ -163,14 +347,200 @@ def execute_order(order: Order, current_market_price: float, slippage_pips: floa
 
     return order
 
+@njit(cache=True, nogil=True)
+def find_stop_triggers(lows, highs, stop_prices, stop_sides):
+    """
+    Finds which symbols' stop-loss orders are triggered by the current bar.
+
+    Args:
+        lows (np.ndarray): Current bar low per symbol slot (NaN if the symbol has no bar).
+        highs (np.ndarray): Current bar high per symbol slot (NaN if the symbol has no bar).
+        stop_prices (np.ndarray): Active stop price per symbol slot.
+        stop_sides (np.ndarray): 1 for a sell stop protecting a long, -1 for a buy stop
+                                 protecting a short, 0 if the slot has no active stop.
+
+    Returns:
+        np.ndarray: Slot indices whose stop was hit, in ascending order.
+    """
+    triggered = np.empty(lows.shape[0], dtype=np.int64)
+    n_triggered = 0
+    for j in range(lows.shape[0]):
+        side = stop_sides[j]
+        if side > 0:
+            if lows[j] <= stop_prices[j]: # NaN (no bar) compares False
+                triggered[n_triggered] = j
+                n_triggered += 1
+        elif side < 0:
+            if highs[j] >= stop_prices[j]:
+                triggered[n_triggered] = j
+                n_triggered += 1
+    return triggered[:n_triggered]
+
+@njit(cache=True, nogil=True)
+def find_next_event_bar(start, entry_signals, long_exits, short_exits, lows, highs,
+                        position_sides, stop_prices, stop_sides, entries_enabled):
+    """
+    Finds the first bar at or after `start` on which the current portfolio state can change.
+
+    With positions and stops fixed, a bar needs processing only if an active stop is hit, a
+    held position meets its Donchian exit, or a flat market has an entry signal. Every other
+    bar only marks open positions to market.
+
+    Args:
+        start (int): First bar to examine.
+        entry_signals (np.ndarray): (bars x slots) entry signal, 1 long / -1 short / 0 none.
+        long_exits (np.ndarray): (bars x slots) True where a long position's exit condition holds.
+        short_exits (np.ndarray): (bars x slots) True where a short position's exit condition holds.
+        lows (np.ndarray): (bars x slots) bar lows (NaN where the symbol has no bar).
+        highs (np.ndarray): (bars x slots) bar highs (NaN where the symbol has no bar).
+        position_sides (np.ndarray): Per slot, > 0 long, < 0 short, 0 flat.
+        stop_prices (np.ndarray): Active stop price per slot.
+        stop_sides (np.ndarray): Per slot, 1 sell stop, -1 buy stop, 0 no active stop.
+        entries_enabled (bool): False when new entries are suppressed (emergency stop).
+
+    Returns:
+        int: Index of the next event bar, or the number of bars if there is none.
+    """
+    n_bars = entry_signals.shape[0]
+    n_slots = entry_signals.shape[1]
+    for i in range(start, n_bars):
+        for j in range(n_slots):
+            side = stop_sides[j]
+            if side > 0 and lows[i, j] <= stop_prices[j]:
+                return i
+            if side < 0 and highs[i, j] >= stop_prices[j]:
+                return i
+            held = position_sides[j]
+            if held > 0:
+                if long_exits[i, j]:
+                    return i
+            elif held < 0:
+                if short_exits[i, j]:
+                    return i
+            elif entries_enabled and entry_signals[i, j] != 0:
+                return i
+    return n_bars
+
 class PortfolioManager:
     def __init__(self, initial_capital: float, config: dict):
         self.positions: dict[str, Position] = {}
         self.orders: list[Order] = []
+        self._mutation_count = 0
         self.capital = initial_capital
         self.initial_capital = initial_capital
-        self.trade_log: list[dict] = [] # To store details of executed trades
+        self.trade_log = TradeLog() # Details of executed trades (list-like, stored column-wise)
+        # Trade details are only recorded when enabled; parameter sweeps that never read the log
+        # can skip it. `trade_count` counts executed trades either way.
+        self.trade_log_enabled: bool = config.get('enable_trade_log', True)
+        self.trade_count = 0
         self.config = config # Store relevant config like pip_point_value, lot_size, etc.
+        # The single pending stop-loss order per symbol. Filled/cancelled orders stay in
+        # `self.orders` for reporting, but only this dict is scanned on each bar.
+        self.active_stops: dict[str, Order] = {}
+        # Structure-of-arrays mirror of `positions` and `active_stops`, one slot per symbol
+        # (configured markets first). `positions` stays the public view; the arrays back the
+        # hot-path aggregations and the stop-trigger kernel.
+        self.symbols: list[str] = list(config.get('markets', []))
+        self.symbol_index: dict[str, int] = {s: k for k, s in enumerate(self.symbols)}
+        self.position_quantities = np.zeros(len(self.symbols)) # Signed; 0.0 when flat
+        self.position_entry_prices = np.full(len(self.symbols), np.nan)
+        self.stop_prices = np.full(len(self.symbols), np.nan)
+        self.stop_sides = np.zeros(len(self.symbols), dtype=np.int8)
+        # Pip/point value per unit for each slot, resolved from config once (NaN if not configured)
+        self._pip_point_values_config = config.get('pip_point_value', {})
+        self.pip_values = np.array([self._pip_point_values_config.get(s, np.nan) for s in self.symbols], dtype=np.float64)
+        self._order_counter = 0 # Monotonic sequence for generated order IDs
+        # Per-bar equity memoization: `_mutation_count` (set before capital) is bumped whenever capital
+        # or positions change, so a cached value is only reused for the same bar with nothing changed in between.
+        self._pnl_cache_key: Optional[tuple] = None
+        self._equity_cache_key: Optional[tuple] = None
+        self._cached_equity = 0.0
+        self._equity_at_cache_key: Optional[tuple] = None
+        self._cached_equity_at = 0.0
+        # Open-risk memoization: the monetary risk depends only on positions, stops and pip values,
+        # so it is reused until `_risk_version` is bumped by a position or stop change.
+        self._risk_version = 0
+        self._cached_risk_version: Optional[int] = None
+        self._cached_monetary_risk = 0.0
+        # Price each position's `unrealized_pnl` was last computed at; entries are dropped whenever the
+        # position changes, so an unchanged price means the stored P&L is still exact.
+        self._marked_prices: dict[str, float] = {}
+
+    @property
+    def capital(self) -> float:
+        """Cash capital: the running sum of all cash flows plus its Neumaier compensation term."""
+        return self._capital_sum + self._capital_compensation
+
+    @capital.setter
+    def capital(self, value: float):
+        self._capital_sum = value
+        self._capital_compensation = 0.0
+        self._mutation_count += 1 # Equity memoized for the current bar no longer matches capital
+
+    def _add_to_capital(self, amount: float):
+        """
+        Adds a cash flow (commission, realized P&L) to capital with Neumaier compensated summation.
+
+        The low-order bits each float addition drops are collected in a separate compensation
+        term, so capital does not drift over thousands of trades.
+        """
+        running_sum = self._capital_sum
+        new_sum = running_sum + amount
+        if abs(running_sum) >= abs(amount):
+            self._capital_compensation += (running_sum - new_sum) + amount
+        else:
+            self._capital_compensation += (amount - new_sum) + running_sum
+        self._capital_sum = new_sum
+
+    def next_order_sequence(self) -> int:
+        """Returns the next integer in the portfolio's order ID sequence (starting at 1)."""
+        self._order_counter += 1
+        return self._order_counter
+
+    def _symbol_slot(self, symbol: str) -> int:
+        """Returns the array slot for `symbol`, appending one for symbols outside `markets`."""
+        slot = self.symbol_index.get(symbol)
+        if slot is None:
+            slot = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_index[symbol] = slot
+            self.position_quantities = np.append(self.position_quantities, 0.0)
+            self.position_entry_prices = np.append(self.position_entry_prices, np.nan)
+            self.stop_prices = np.append(self.stop_prices, np.nan)
+            self.stop_sides = np.append(self.stop_sides, np.int8(0))
+            self.pip_values = np.append(self.pip_values, self._pip_point_values_config.get(symbol, np.nan))
+        return slot
+
+    def _sync_position_slot(self, symbol: str):
+        """Copies the quantity and entry price of `symbol`'s position (or flat) into the arrays."""
+        slot = self._symbol_slot(symbol)
+        self._marked_prices.pop(symbol, None)
+        self._risk_version += 1
+        position = self.positions.get(symbol)
+        if position is None:
+            self.position_quantities[slot] = 0.0
+            self.position_entry_prices[slot] = np.nan
+        else:
+            self.position_quantities[slot] = position.quantity
+            self.position_entry_prices[slot] = position.average_entry_price
+
+    def _set_active_stop(self, symbol: str, stop_order: Order):
+        """Registers `stop_order` as the pending stop-loss for `symbol`."""
+        self.active_stops[symbol] = stop_order
+        slot = self._symbol_slot(symbol)
+        self.stop_prices[slot] = stop_order.order_price
+        self.stop_sides[slot] = 1 if stop_order.trade_action == "sell" else -1
+        self._risk_version += 1
+
+    def _clear_active_stop(self, symbol: str) -> Optional[Order]:
+        """Removes and returns the registered stop-loss for `symbol`, if any."""
+        stop_order = self.active_stops.pop(symbol, None)
+        if stop_order is not None:
+            slot = self.symbol_index[symbol]
+            self.stop_prices[slot] = np.nan
+            self.stop_sides[slot] = 0
+            self._risk_version += 1
+        return stop_order
 
     def record_order(self, order: Order):
         """Adds an order to the internal list of orders."""
@@ -189,20 +559,7 @@ class PortfolioManager:
             raise ValueError("Quantity for opening a position must be positive.")
 
         position_quantity = quantity if trade_action == "buy" else -quantity
-        cost_or_proceeds = position_quantity * entry_price # This is negative for buys, positive for sells in terms of cash flow for position value
-                                                        # but capital changes are handled by commission and P&L.
-
-        trade_details = {
-            "order_id": order_id,
-            "symbol": symbol,
-            "action": trade_action,
-            "quantity": quantity,
-            "price": entry_price,
-            "timestamp": entry_time,
-            "commission": commission,
-            "slippage": slippage_value,
-            "type": "entry"
-        }
+        # Capital is not charged the position's notional; it changes only by commission and realized P&L.
 
         if symbol not in self.positions:
             new_position = Position(
@@ -211,7 +568,8 @@ class PortfolioManager:
                 average_entry_price=entry_price,
                 initial_stop_loss_price=stop_loss_price,
                 current_stop_loss_price=stop_loss_price,
-                related_entry_order_id=order_id
+                related_entry_order_id=order_id,
+                last_update_timestamp=entry_time
             )
             self.positions[symbol] = new_position
         else:
@@ -224,9 +582,6 @@ class PortfolioManager:
                 raise ValueError(f"Opposing trade for existing position {symbol}. Handle closure separately.")
 
             # Averaging existing position
-            total_value_existing = existing_position.quantity * existing_position.average_entry_price
-            total_value_new = position_quantity * entry_price # position_quantity is signed
-
             new_total_quantity = existing_position.quantity + position_quantity
 
             if new_total_quantity == 0: # Effectively closed out
@@ -235,7 +590,10 @@ class PortfolioManager:
                 # Realized P&L calculation would be needed here.
                 # For now, open_position is for opening/increasing.
             else:
-                existing_position.average_entry_price = (total_value_existing + total_value_new) / new_total_quantity
+                # Running-mean update: moves the average toward the new fill by the added share of the
+                # total (both quantities are signed alike), without forming the large notional sums
+                existing_position.average_entry_price += \
+                    (entry_price - existing_position.average_entry_price) * position_quantity / new_total_quantity
                 existing_position.quantity = new_total_quantity
                 existing_position.last_update_timestamp = entry_time
                 # Potentially update SL, TP if strategy dictates
@@ -247,8 +605,12 @@ class PortfolioManager:
         # Commission is a direct reduction in capital.
         # Slippage is already incorporated into the entry_price from execute_order.
         # The "cost" of the position itself is reflected in unrealized P&L.
-        self.capital -= commission
-        self.trade_log.append(trade_details)
+        self._add_to_capital(-commission)
+        self._mutation_count += 1
+        self.trade_count += 1
+        if self.trade_log_enabled:
+            self.trade_log.record(order_id, symbol, trade_action, quantity, entry_price, entry_time,
+                                  commission, slippage_value, "entry")
 
         # Create and record the stop-loss order
         if stop_loss_price is not None:
@@ -271,16 +633,31 @@ class PortfolioManager:
                 trade_action=sl_trade_action,
                 quantity=abs(target_position.quantity), # SL covers the full current position
                 order_price=stop_loss_price,
-                status="pending"
-                # timestamp_created is handled by Order.__init__
+                status="pending",
+                timestamp_created=entry_time
             )
             self.record_order(stop_loss_order)
+            # A scale-in replaces the stop for the whole position; retire the superseded one
+            superseded_stop = self.active_stops.get(symbol)
+            if superseded_stop is not None and superseded_stop.status == "pending":
+                superseded_stop.status = "cancelled"
+            self._set_active_stop(symbol, stop_loss_order)
             target_position.active_stop_loss_order_id = sl_order_id
             # print(f"Created SL order: {sl_order_id} for position {target_position.symbol} at {stop_loss_price}")
 
-        # print(f"Opened/Increased position: {trade_details}, Capital: {self.capital}")
+        self._sync_position_slot(symbol)
 
 
+    @staticmethod
+    def _realized_pnl(signed_quantity: float, exit_price: float, average_entry_price: float, commission: float) -> float:
+        """
+        Net realized P&L of closing `signed_quantity` (positive for longs, negative for shorts).
+
+        (exit - entry) * quantity covers both directions: a short gains when the exit is below
+        entry. Negation is exact in floating point, so this equals the per-direction formulas.
+        """
+        return (exit_price - average_entry_price) * signed_quantity - commission
+
     def close_position_completely(self, symbol: str, exit_price: float, exit_time: datetime,
                                   order_id: str, commission: float, slippage_value: float):
         """Closes the entire position for a symbol and calculates realized P&L."""
@@ -291,19 +668,11 @@ class PortfolioManager:
         quantity_closed = abs(position.quantity)
         trade_action = "sell" if position.quantity > 0 else "buy" # Action to close
 
-        # Calculate Realized P&L
-        # For long position (quantity > 0), P&L = (exit_price - entry_price) * quantity
-        # For short position (quantity < 0), P&L = (entry_price - exit_price) * abs(quantity)
-        # Or more generally: (exit_price - entry_price) * position.quantity (if exit is sell for long, buy for short)
-        # Let's consider the cash flow perspective for P&L
-        if position.quantity > 0: # Long position
-            realized_pnl = (exit_price - position.average_entry_price) * position.quantity
-        else: # Short position
-            realized_pnl = (position.average_entry_price - exit_price) * abs(position.quantity)
+        # Calculate Realized P&L, net of commission, for the whole signed quantity
+        realized_pnl = self._realized_pnl(position.quantity, exit_price, position.average_entry_price, commission)
 
-        realized_pnl -= commission # Net P&L after commission
-
-        self.capital += realized_pnl # Add net P&L to capital
+        self._add_to_capital(realized_pnl) # Add net P&L to capital
+        self._mutation_count += 1
         # The proceeds/cost of the closing trade itself also affect cash if not just using P&L.
         # Example: Buy 100 shares at $10 (cost $1000). Sell at $12 (proceeds $1200). P&L = $200.
         # Capital change = $1200 (inflow) - $1000 (outflow reflected in initial P&L) = $200.
@@ -320,21 +689,14 @@ class PortfolioManager:
 
         position.realized_pnl += realized_pnl # Accumulate on position object too, though it's being deleted.
 
-        trade_details = {
-            "order_id": order_id,
-            "symbol": symbol,
-            "action": trade_action, # The action that closed the position
-            "quantity": quantity_closed,
-            "price": exit_price,
-            "timestamp": exit_time,
-            "commission": commission,
-            "slippage": slippage_value,
-            "realized_pnl": realized_pnl,
-            "type": "exit"
-        }
-        self.trade_log.append(trade_details)
+        self.trade_count += 1
+        if self.trade_log_enabled:
+            self.trade_log.record(order_id, symbol, trade_action, # The action that closed the position
+                                  quantity_closed, exit_price, exit_time, commission, slippage_value,
+                                  "exit", realized_pnl)
         del self.positions[symbol]
-        # print(f"Closed position: {trade_details}, Capital: {self.capital}")
+        self._clear_active_stop(symbol)
+        self._sync_position_slot(symbol)
 
 
     def reduce_position(self, symbol: str, quantity_to_close: float, exit_price: float,
@@ -353,39 +715,24 @@ class PortfolioManager:
 
         trade_action = "sell" if position.quantity > 0 else "buy"  # Action to reduce/close
 
-        # Calculate Realized P&L for the part being closed
-        if position.quantity > 0: # Long position
-            realized_pnl_reduction = (exit_price - position.average_entry_price) * quantity_to_close
-        else: # Short position
-            realized_pnl_reduction = (position.average_entry_price - exit_price) * quantity_to_close
-
-        realized_pnl_reduction -= commission # Net P&L for this reduction
+        # Calculate Realized P&L for the part being closed, signed like the position
+        closed_quantity = quantity_to_close if position.quantity > 0 else -quantity_to_close
+        realized_pnl_reduction = self._realized_pnl(closed_quantity, exit_price, position.average_entry_price, commission)
 
-        self.capital += realized_pnl_reduction # Adjust capital by the net P&L of the reduction
+        self._add_to_capital(realized_pnl_reduction) # Adjust capital by the net P&L of the reduction
+        self._mutation_count += 1
         position.realized_pnl += realized_pnl_reduction # Accumulate realized P&L on the position
 
-        # Update position quantity
-        if position.quantity > 0:
-            position.quantity -= quantity_to_close
-        else:
-            position.quantity += quantity_to_close # quantity_to_close is positive, position.quantity is negative
+        # Update position quantity (moves toward zero for longs and shorts alike)
+        position.quantity -= closed_quantity
 
         position.last_update_timestamp = exit_time
+        self._sync_position_slot(symbol)
 
-        trade_details = {
-            "order_id": order_id,
-            "symbol": symbol,
-            "action": trade_action,
-            "quantity": quantity_to_close,
-            "price": exit_price,
-            "timestamp": exit_time,
-            "commission": commission,
-            "slippage": slippage_value,
-            "realized_pnl": realized_pnl_reduction,
-            "type": "reduction"
-        }
-        self.trade_log.append(trade_details)
-        # print(f"Reduced position: {trade_details}, Capital: {self.capital}")
+        self.trade_count += 1
+        if self.trade_log_enabled:
+            self.trade_log.record(order_id, symbol, trade_action, quantity_to_close, exit_price, exit_time,
+                                  commission, slippage_value, "reduction", realized_pnl_reduction)
 
 
     def get_open_position(self, symbol: str) -> Optional[Position]:
@@ -401,26 +748,43 @@ class PortfolioManager:
         """
         return self.positions.get(symbol)
 
-    def update_unrealized_pnl(self, current_prices: Dict[str, float]):
+    def update_unrealized_pnl(self, current_prices: Dict[str, float], bar_epoch: Optional[int] = None,
+                              timestamp: Optional[datetime] = None):
         """
         Updates the unrealized P&L for all currently open positions.
 
         The calculation is based on the difference between the current market price
-        and the position's average entry price.
+        and the position's average entry price. Positions whose price is unchanged since
+        their last update (and that have not been modified since) are skipped.
 
         Args:
             current_prices (Dict[str, float]): A dictionary mapping symbols to their
                                                current market prices. If a symbol for an
                                                open position is not in this dict, its P&L
                                                may be set to None or a warning printed.
+            bar_epoch (Optional[int], optional): Identifier of the bar `current_prices` belongs to
+                                                 (e.g. the bar index). When given, a following
+                                                 `get_total_equity` call for the same bar reuses
+                                                 this update. Defaults to None.
+            timestamp (Optional[datetime], optional): Time of `current_prices` (e.g. the bar time),
+                                                      stamped on each updated position. Defaults to
+                                                      None (wall-clock time, read once per call).
         """
+        if timestamp is None:
+            timestamp = datetime.now()
+        self._pnl_cache_key = (bar_epoch, self._mutation_count) if bar_epoch is not None else None
+        marked_prices = self._marked_prices
         for symbol, position in self.positions.items():
             if symbol not in current_prices:
-                print(f"Warning: Current market price for {symbol} not available. Cannot update unrealized P&L.")
+                trading_logger.debug("Current market price for %s not available. Cannot update unrealized P&L.", symbol)
                 position.unrealized_pnl = None # Indicate P&L is currently unknown or stale
+                marked_prices.pop(symbol, None)
                 continue
 
             current_price = current_prices[symbol]
+            if marked_prices.get(symbol) == current_price: # Price hasn't moved: P&L is unchanged
+                continue
+            marked_prices[symbol] = current_price
             if position.quantity > 0: # Long position
                 position.unrealized_pnl = (current_price - position.average_entry_price) * position.quantity
             elif position.quantity < 0: # Short position
@@ -428,9 +792,9 @@ class PortfolioManager:
             else:
                 # This case should ideally not occur for a position listed in self.positions
                 position.unrealized_pnl = 0.0
-            position.last_update_timestamp = datetime.now() # Or use timestamp from data feed if available
+            position.last_update_timestamp = timestamp
 
-    def get_total_equity(self, current_prices: Dict[str, float]) -> float:
+    def get_total_equity(self, current_prices: Dict[str, float], bar_epoch: Optional[int] = None) -> float:
         """
         Calculates the total current equity of the portfolio.
 
@@ -441,13 +805,77 @@ class PortfolioManager:
         Args:
             current_prices (Dict[str, float]): Current market prices for all symbols
                                                held in open positions, used to update P&L.
+            bar_epoch (Optional[int], optional): Identifier of the bar `current_prices` belongs to.
+                                                 When given, the result is memoized until the bar
+                                                 changes or a position is opened, reduced or closed.
+                                                 Defaults to None (always recompute).
 
         Returns:
             float: The total current equity of the portfolio.
         """
-        self.update_unrealized_pnl(current_prices) # Ensure P&L is up-to-date
+        cache_key = (bar_epoch, self._mutation_count) if bar_epoch is not None else None
+        if cache_key is not None and cache_key == self._equity_cache_key:
+            return self._cached_equity
+        if cache_key is None or cache_key != self._pnl_cache_key:
+            self.update_unrealized_pnl(current_prices, bar_epoch) # Ensure P&L is up-to-date
         total_unrealized_pnl = sum(pos.unrealized_pnl for pos in self.positions.values() if pos.unrealized_pnl is not None)
-        return self.capital + total_unrealized_pnl
+        self._equity_cache_key = cache_key
+        self._cached_equity = self.capital + total_unrealized_pnl
+        return self._cached_equity
+
+    def get_total_equity_for_bars(self, price_matrix: np.ndarray) -> np.ndarray:
+        """
+        Calculates total equity for a run of bars over which no position changes.
+
+        Equivalent to calling `get_total_equity` once per bar, vectorized across the run:
+        cash capital plus the unrealized P&L of each open position, where a position whose
+        symbol has no price on a bar contributes nothing to that bar.
+
+        Args:
+            price_matrix (np.ndarray): (bars x slots) prices, columns in symbol slot order
+                                       (NaN where a symbol has no price).
+
+        Returns:
+            np.ndarray: Total equity per bar.
+        """
+        n_slots = price_matrix.shape[1]
+        held_slots = np.flatnonzero(self.position_quantities[:n_slots])
+        if len(held_slots) == 0:
+            return np.full(price_matrix.shape[0], float(self.capital))
+        # (price - entry) * quantity covers shorts too, as quantity is negative for them
+        unrealized_pnl = (price_matrix[:, held_slots] - self.position_entry_prices[held_slots]) * self.position_quantities[held_slots]
+        return self.capital + np.nansum(unrealized_pnl, axis=1)
+
+    def get_total_equity_at(self, prices: np.ndarray, bar_epoch: Optional[int] = None) -> float:
+        """
+        Calculates total equity from a price vector in symbol slot order.
+
+        Same result as `get_total_equity` for the equivalent price dict, computed from the
+        position arrays without touching the Position objects (their `unrealized_pnl` is
+        not updated).
+
+        Args:
+            prices (np.ndarray): Price per symbol slot (NaN where a symbol has no price).
+            bar_epoch (Optional[int], optional): Identifier of the bar `prices` belongs to.
+                                                 When given, the result is memoized until the bar
+                                                 changes or a position is opened, reduced or closed.
+                                                 Defaults to None (always recompute).
+
+        Returns:
+            float: The total current equity of the portfolio.
+        """
+        cache_key = (bar_epoch, self._mutation_count) if bar_epoch is not None else None
+        if cache_key is not None and cache_key == self._equity_at_cache_key:
+            return self._cached_equity_at
+        held_slots = np.flatnonzero(self.position_quantities[:len(prices)])
+        if len(held_slots) == 0:
+            equity = float(self.capital)
+        else:
+            unrealized_pnl = (prices[held_slots] - self.position_entry_prices[held_slots]) * self.position_quantities[held_slots]
+            equity = float(self.capital + np.nansum(unrealized_pnl))
+        self._equity_at_cache_key = cache_key
+        self._cached_equity_at = equity
+        return equity
 
     def get_current_total_open_risk_percentage(self) -> float:
         """
@@ -456,7 +884,8 @@ class PortfolioManager:
         This method sums the monetary risk for all open positions that have an active,
         pending stop-loss order. The risk for each position is defined as the potential
         loss from its average entry price to its stop-loss price, multiplied by the
-        position quantity and the instrument's pip/point value per unit.
+        position quantity and the instrument's pip/point value per unit. A stop that sits
+        on the profitable side of the entry price contributes no risk.
 
         The total monetary risk is then divided by the current portfolio cash capital.
 
@@ -465,32 +894,44 @@ class PortfolioManager:
                    is zero or negative and there's positive monetary risk. Returns 0.0
                    if there's no risk or capital is zero/negative with no risk.
         """
-        total_monetary_risk = 0.0
+        # Only positions with a pending stop carry measurable risk; nothing to sum during warmup/flat periods
+        if not self.active_stops:
+            return 0.0
 
-        for symbol, position in self.positions.items():
-            if position.active_stop_loss_order_id:
-                # Find the associated pending stop-loss order
-                stop_order = next((o for o in self.orders if o.order_id == position.active_stop_loss_order_id and o.status == "pending"), None)
+        if self._cached_risk_version != self._risk_version:
+            self._cached_monetary_risk = self._total_open_monetary_risk()
+            self._cached_risk_version = self._risk_version
+        total_monetary_risk = self._cached_monetary_risk
 
-                if stop_order and stop_order.order_price is not None:
-                    # Retrieve pip/point value per unit for the symbol from config
-                    pip_value_for_one_unit = self.config.get('pip_point_value', {}).get(symbol)
+        if self.capital <= 0:
+            return float('inf') if total_monetary_risk > 0 else 0.0
 
-                    if pip_value_for_one_unit is None:
-                        print(f"Warning: Missing pip_point_value for {symbol} in config. Cannot calculate risk for this position.")
-                        continue # Skip risk calculation for this position
+        return total_monetary_risk / self.capital
 
-                    # Calculate potential loss in price points per unit
-                    potential_loss_price_points = abs(position.average_entry_price - stop_order.order_price)
+    def _total_open_monetary_risk(self) -> float:
+        """Sums the monetary risk (entry to stop, times quantity and pip value) of all stopped positions."""
+        # Slots with an active stop; by construction each belongs to an open position and holds
+        # that position's linked, pending stop-loss order.
+        active_slots = np.flatnonzero(self.stop_sides)
 
-                    # Calculate monetary risk for this specific position
-                    monetary_risk_for_position = potential_loss_price_points * abs(position.quantity) * pip_value_for_one_unit
-                    total_monetary_risk += monetary_risk_for_position
+        # Pip/point value per unit for each position, from the per-slot array resolved at setup
+        pip_values_for_one_unit = self.pip_values[active_slots]
+        missing_pip_values = np.isnan(pip_values_for_one_unit)
+        if missing_pip_values.any():
+            for slot in active_slots[missing_pip_values]:
+                trading_logger.warning("Missing pip_point_value for %s in config. Cannot calculate risk for this position.", self.symbols[slot])
+            pip_values_for_one_unit = np.where(missing_pip_values, 0.0, pip_values_for_one_unit) # Skip risk calculation for these positions
 
-        if self.capital <= 0:
-            return float('inf') if total_monetary_risk > 0 else 0.0
+        # Potential loss in price points per unit. The position's sign orients the entry-to-stop
+        # distance for longs and shorts alike; a stop already past entry on the profitable side
+        # locks in a gain and carries no risk.
+        quantities = self.position_quantities[active_slots]
+        potential_loss_price_points = np.maximum(
+            0.0, np.sign(quantities) * (self.position_entry_prices[active_slots] - self.stop_prices[active_slots])
+        )
 
-        return total_monetary_risk / self.capital
+        # Monetary risk per position, summed
+        return float(np.dot(potential_loss_price_points * np.abs(quantities), pip_values_for_one_unit))
 
 
 # def add_position(positions, new_position, capital):
@@ -595,6 +1036,16 @@ class PortfolioManager:
 #
 #     return total_pnl
 
+# Column layout of the streamed result files (see `results_stream_dir` in `run_strategy`)
+EQUITY_CURVE_COLUMNS = ["timestamp", "equity"]
+TRADE_LOG_COLUMNS = ["order_id", "symbol", "action", "quantity", "price", "timestamp",
+                     "commission", "slippage", "realized_pnl", "type"]
+
+def _append_results_csv(path: str, rows, columns: List[str], write_header: bool):
+    """Appends `rows` (records or a column dict) to the CSV at `path`, creating it when `write_header`."""
+    pd.DataFrame(rows, columns=columns).to_csv(path, mode="w" if write_header else "a",
+                                               header=write_header, index=False)
+
 def run_strategy(historical_data_dict: Dict[str, pd.DataFrame], initial_capital: float, config: Dict, emergency_stop_activated: bool = False) -> Dict:
     """
     Simulates a trading strategy using historical price data for multiple symbols.
@@ -627,302 +1078,657 @@ def run_strategy(historical_data_dict: Dict[str, pd.DataFrame], initial_capital:
         dict: A dictionary containing the results of the backtest, with keys:
             "equity_curve" (list): A list of (timestamp, equity) tuples representing
                                    the portfolio's total equity over time.
-            "trade_log" (list): A list of dictionaries, where each dictionary details
-                                an executed trade (from PortfolioManager.trade_log).
+            "trade_log" (TradeLog): The executed trades (PortfolioManager.trade_log); a
+                                    list-like sequence of dictionaries, one per trade.
             "final_capital" (float): The final cash capital in the portfolio.
             "portfolio_summary" (dict): Optional dictionary with more summary statistics.
+
+        If `config['results_stream_dir']` is set, the equity curve and trade log are instead
+        appended to `equity_curve.csv` and `trade_log.csv` in that directory after every
+        backtest tile (`backtest_tile_size` bars), so at most one tile of either is held in
+        memory. The returned "equity_curve" and "trade_log" are then empty, and the file paths are
+        returned as "equity_curve_path" and "trade_log_path".
     """
-    # --- DEBUGGING: Log historical_data_dict details ---
-    print("DEBUG TRADING_LOGIC: Entering run_strategy")
-    print(f"DEBUG TRADING_LOGIC: historical_data_dict keys: {list(historical_data_dict.keys())}")
-    for symbol, df in historical_data_dict.items():
-        print(f"DEBUG TRADING_LOGIC: Data for symbol: {symbol}")
-        if df is not None and isinstance(df, pd.DataFrame) and not df.empty:
-            print(f"DEBUG TRADING_LOGIC:   Number of rows: {len(df)}")
-            if isinstance(df.index, pd.DatetimeIndex):
-                print(f"DEBUG TRADING_LOGIC:   First timestamp: {df.index.min()}")
-                print(f"DEBUG TRADING_LOGIC:   Last timestamp: {df.index.max()}")
-            else:
-                print("DEBUG TRADING_LOGIC:   DataFrame index is not a DatetimeIndex.")
-        elif df is None:
-            print("DEBUG TRADING_LOGIC:   DataFrame is None.")
-        elif not isinstance(df, pd.DataFrame):
-            print(f"DEBUG TRADING_LOGIC:   Object is not a DataFrame, it's a {type(df)}.")
-        elif df.empty:
-            print("DEBUG TRADING_LOGIC:   DataFrame is empty.")
-    print("DEBUG TRADING_LOGIC: --- End of historical_data_dict logging ---")
+    # --- DEBUGGING: Log historical_data_dict details (skipped entirely unless DEBUG is enabled) ---
+    if trading_logger.isEnabledFor(logging.DEBUG):
+        trading_logger.debug("Entering run_strategy")
+        trading_logger.debug("historical_data_dict keys: %s", list(historical_data_dict.keys()))
+        for symbol, df in historical_data_dict.items():
+            trading_logger.debug("Data for symbol: %s", symbol)
+            if df is not None and isinstance(df, pd.DataFrame) and not df.empty:
+                trading_logger.debug("  Number of rows: %d", len(df))
+                if isinstance(df.index, pd.DatetimeIndex):
+                    trading_logger.debug("  First timestamp: %s", df.index.min())
+                    trading_logger.debug("  Last timestamp: %s", df.index.max())
+                else:
+                    trading_logger.debug("  DataFrame index is not a DatetimeIndex.")
+            elif df is None:
+                trading_logger.debug("  DataFrame is None.")
+            elif not isinstance(df, pd.DataFrame):
+                trading_logger.debug("  Object is not a DataFrame, it's a %s.", type(df))
+            elif df.empty:
+                trading_logger.debug("  DataFrame is empty.")
+        trading_logger.debug("--- End of historical_data_dict logging ---")
     # --- End of DEBUGGING ---
 
     portfolio_manager = PortfolioManager(initial_capital=initial_capital, config=config)
-    equity_curve = [] # Stores (timestamp, equity) tuples
 
     # --- 1. Initialization: Prepare Data and Pre-calculate Indicators ---
-    all_timestamps = set()
-    for symbol_data_df_val in historical_data_dict.values(): # Use a different var name
-        if isinstance(symbol_data_df_val, pd.DataFrame) and not symbol_data_df_val.empty:
-            all_timestamps.update(symbol_data_df_val.index)
+    # Global timeline: the union of all symbols' timestamps, deduplicated and sorted as one
+    # vectorized index operation rather than through a set of Timestamp objects
+    symbol_indexes = [symbol_data_df_val.index for symbol_data_df_val in historical_data_dict.values() # Use a different var name
+                      if isinstance(symbol_data_df_val, pd.DataFrame) and not symbol_data_df_val.empty]
+    timeline_index = symbol_indexes[0].append(symbol_indexes[1:]).unique().sort_values() if symbol_indexes else pd.Index([])
 
-    sorted_timestamps = sorted(list(all_timestamps))
-
-    if not sorted_timestamps:
+    if timeline_index.empty:
         return { # Basic results for no data
             "equity_curve": [], "trade_log": portfolio_manager.trade_log,
             "final_capital": portfolio_manager.capital,
+            "portfolio_summary": {"initial_capital": initial_capital, "final_equity": initial_capital, "total_trades": 0},
             "message": "No historical data provided or data was empty."
         }
 
     # Pre-calculate technical indicators for each symbol to be used in the strategy
     atr_period_val = config.get('atr_period', 20) # Default ATR period if not in config
+    atr_smoothing_val = config.get('atr_smoothing', 'sma') # "sma" or "wilder"
     entry_donchian_period_val = config['entry_donchian_period']
     long_exit_donchian_period_val = config['take_profit_long_exit_period']
     short_exit_donchian_period_val = config['take_profit_short_exit_period']
 
-    processed_historical_data = {}
+    valid_historical_data = {}
     for symbol, data_df in historical_data_dict.items():
         if not isinstance(data_df, pd.DataFrame) or data_df.empty:
-            print(f"Warning: Data for symbol {symbol} is not a valid DataFrame or is empty. Skipping indicator calculation for this symbol.")
+            trading_logger.warning("Data for symbol %s is not a valid DataFrame or is empty. Skipping indicator calculation for this symbol.", symbol)
             continue
+        valid_historical_data[symbol] = data_df
+
+    # Indicators for all symbols at once: the price columns are laid out back to back and each
+    # symbol's segment is computed independently (in parallel when Numba is available).
+    segment_lengths = [len(df) for df in valid_historical_data.values()]
+    segment_bounds = np.zeros(len(segment_lengths) + 1, dtype=np.int64)
+    np.cumsum(segment_lengths, out=segment_bounds[1:])
+    all_highs = np.concatenate([df['High'].to_numpy(dtype=np.float64) for df in valid_historical_data.values()]) \
+        if valid_historical_data else np.empty(0)
+    all_lows = np.concatenate([df['Low'].to_numpy(dtype=np.float64) for df in valid_historical_data.values()]) \
+        if valid_historical_data else np.empty(0)
+    all_closes = np.concatenate([df['Close'].to_numpy(dtype=np.float64) for df in valid_historical_data.values()]) \
+        if valid_historical_data else np.empty(0)
+    if atr_period_val <= 0:
+        raise ValueError("Period must be a positive integer.")
+    if atr_smoothing_val not in ("sma", "wilder"):
+        raise ValueError("ATR smoothing must be 'sma' or 'wilder'.")
+    all_atr = _atr_by_segment(all_highs, all_lows, all_closes, segment_bounds, atr_period_val, atr_smoothing_val)
+    donchian_bands_by_period = {}
+    for period in (entry_donchian_period_val, long_exit_donchian_period_val, short_exit_donchian_period_val):
+        if period not in donchian_bands_by_period:
+            if period <= 0:
+                raise ValueError("Period must be a positive integer.")
+            donchian_bands_by_period[period] = _donchian_bands_by_segment(all_highs, all_lows, segment_bounds, period)
+    # Entry signals don't depend on the portfolio, so they are evaluated for every symbol's whole
+    # history up front, segment by segment like the indicators; only the bar walk below is sequential.
+    all_entry_signals = _entry_signals_by_segment(all_closes, *donchian_bands_by_period[entry_donchian_period_val], segment_bounds)
+
+    # Per-symbol slices of the precomputed arrays, in the order of the symbol's own index. The input
+    # frames are only read (no copy with indicator columns attached), which keeps peak memory at the
+    # price data plus the flat indicator arrays. Exit bands are shifted by one bar within the symbol,
+    # so each value is the previous bar's band.
+    def _previous_bar(values):
+        shifted = np.empty_like(values)
+        shifted[:1] = np.nan
+        shifted[1:] = values[:-1]
+        return shifted
+
+    symbol_arrays = {}
+    long_exit_lower_band = donchian_bands_by_period[long_exit_donchian_period_val][1]
+    short_exit_upper_band = donchian_bands_by_period[short_exit_donchian_period_val][0]
+    for segment, symbol in enumerate(valid_historical_data):
+        start, end = segment_bounds[segment], segment_bounds[segment + 1]
+        symbol_arrays[symbol] = {
+            'close': all_closes[start:end], 'high': all_highs[start:end], 'low': all_lows[start:end],
+            'atr': all_atr[start:end],
+            'prev_long_exit_lower': _previous_bar(long_exit_lower_band[start:end]),
+            'prev_short_exit_upper': _previous_bar(short_exit_upper_band[start:end]),
+            'entry_signal': all_entry_signals[start:end],
+        }
 
-        df = data_df.copy() # Work on a copy to avoid modifying original data
-
-        # Calculate and add ATR column
-        df[f'atr_{atr_period_val}'] = calculate_atr(df['High'], df['Low'], df['Close'], period=atr_period_val)
-
-        # Calculate and add Donchian Channels for entry signals
-        df[f'donchian_upper_entry_{entry_donchian_period_val}'], df[f'donchian_lower_entry_{entry_donchian_period_val}'] = \
-            calculate_donchian_channel(df['High'], df['Low'], period=entry_donchian_period_val)
-
-        # Calculate and add Donchian Channels for long position exits
-        df[f'donchian_upper_long_exit_{long_exit_donchian_period_val}'], df[f'donchian_lower_long_exit_{long_exit_donchian_period_val}'] = \
-            calculate_donchian_channel(df['High'], df['Low'], period=long_exit_donchian_period_val)
-
-        # Calculate and add Donchian Channels for short position exits
-        df[f'donchian_upper_short_exit_{short_exit_donchian_period_val}'], df[f'donchian_lower_short_exit_{short_exit_donchian_period_val}'] = \
-            calculate_donchian_channel(df['High'], df['Low'], period=short_exit_donchian_period_val)
-
-        processed_historical_data[symbol] = df
-
-    # --- 2. Main Backtesting Loop: Iterate through each timestamp ---
-    for timestamp in sorted_timestamps:
-        current_prices = {} # Stores close prices for symbols at the current timestamp
-        for symbol in config.get('markets', []): # Iterate through configured markets
-            if symbol in processed_historical_data:
-                data_for_symbol = processed_historical_data[symbol]
-                if timestamp in data_for_symbol.index:
-                    current_prices[symbol] = data_for_symbol.loc[timestamp, 'Close']
-
-        # Update portfolio's unrealized P&L and record equity at each step
-        portfolio_manager.update_unrealized_pnl(current_prices)
-        equity = portfolio_manager.get_total_equity(current_prices)
-        equity_curve.append((timestamp, equity))
-
-        # --- Trading Logic Sections ---
-
-        # Section 2.1: Process pending stop-loss orders
-        pending_stop_orders = [o for o in portfolio_manager.orders if o.order_type == "stop" and o.status == "pending"]
-        for stop_order in pending_stop_orders:
-            symbol = stop_order.symbol
-            if symbol not in processed_historical_data or timestamp not in processed_historical_data[symbol].index:
-                continue # Skip if market data for this timestamp is missing
-
-            market_data_at_timestamp = processed_historical_data[symbol].loc[timestamp]
-            current_high = market_data_at_timestamp['High']
-            current_low = market_data_at_timestamp['Low']
-
-            triggered = False # Flag to indicate if stop order is triggered
-            if stop_order.trade_action == "sell" and current_low <= stop_order.order_price: # SL for long
-                triggered = True
-            elif stop_order.trade_action == "buy" and current_high >= stop_order.order_price: # SL for short
-                triggered = True
-
-            if triggered:
-                # Execute the triggered stop order
-                executed_order = execute_order(
-                    order=stop_order, current_market_price=stop_order.order_price,
-                    slippage_pips=config['slippage_pips'], commission_per_lot=config['commission_per_lot'],
-                    pip_point_value=config['pip_point_value'][symbol], lot_size=config['lot_size'][symbol],
-                    timestamp_filled_param=timestamp
-                )
-                if executed_order.status == "filled":
-                    try:
-                        # Close the position in portfolio manager
-                        portfolio_manager.close_position_completely(
-                            symbol=symbol, exit_price=executed_order.fill_price,
-                            exit_time=executed_order.timestamp_filled or timestamp,
-                            order_id=executed_order.order_id, commission=executed_order.commission,
-                            slippage_value=executed_order.slippage
-                        )
-                        # Future enhancement: Cancel any corresponding take-profit order for this position.
-                    except ValueError as e:
-                        print(f"Error closing position after SL for {symbol} at {timestamp}: {e}")
-
-        # Section 2.2: Process take-profit signals (Donchian Channel exits)
-        for symbol in list(portfolio_manager.positions.keys()): # Iterate on a copy of keys for safe removal
-            position = portfolio_manager.get_open_position(symbol)
-            if not position: continue # Position might have been closed by SL
-
-            if symbol not in processed_historical_data or timestamp not in processed_historical_data[symbol].index:
-                continue
-
-            market_data_at_timestamp = processed_historical_data[symbol].loc[timestamp]
-            current_close = market_data_at_timestamp['Close']
-            if pd.isna(current_close): continue
-
-            try: # Using f-string constructed column names for clarity
-                long_exit_col = f"donchian_lower_long_exit_{config['take_profit_long_exit_period']}"
-                prev_donchian_lower_for_long_exit = processed_historical_data[symbol][long_exit_col].shift(1).loc[timestamp]
-                short_exit_col = f"donchian_upper_short_exit_{config['take_profit_short_exit_period']}"
-                prev_donchian_upper_for_short_exit = processed_historical_data[symbol][short_exit_col].shift(1).loc[timestamp]
-            except KeyError: continue # Missing Donchian data (e.g. start of series)
-            if pd.isna(prev_donchian_lower_for_long_exit) or pd.isna(prev_donchian_upper_for_short_exit):
-                continue # Not enough data for shifted Donchian value
-
-            take_profit_triggered = False
-            trade_action_on_exit = ""
-            if position.quantity > 0 and current_close < prev_donchian_lower_for_long_exit: # Long exit
-                take_profit_triggered = True; trade_action_on_exit = "sell"
-            elif position.quantity < 0 and current_close > prev_donchian_upper_for_short_exit: # Short exit
-                take_profit_triggered = True; trade_action_on_exit = "buy"
-
-            if take_profit_triggered:
-                tp_order_id = f"{timestamp.strftime('%Y%m%d%H%M%S')}_{symbol}_TP"
-                market_exit_order = Order( # Create a market order to exit
-                    order_id=tp_order_id, symbol=symbol, order_type="market",
-                    trade_action=trade_action_on_exit, quantity=abs(position.quantity)
-                )
-                portfolio_manager.record_order(market_exit_order)
-                # Execute the take-profit market order
-                executed_exit_order = execute_order(
-                    order=market_exit_order, current_market_price=current_close,
-                    slippage_pips=config['slippage_pips'], commission_per_lot=config['commission_per_lot'],
-                    pip_point_value=config['pip_point_value'][symbol], lot_size=config['lot_size'][symbol],
-                    timestamp_filled_param=timestamp
-                )
-                if executed_exit_order.status == "filled":
-                    try:
-                        active_sl_order_id_to_cancel = position.active_stop_loss_order_id
-                        # Close position in portfolio manager
-                        portfolio_manager.close_position_completely(
-                            symbol=symbol, exit_price=executed_exit_order.fill_price,
-                            exit_time=executed_exit_order.timestamp_filled or timestamp,
-                            order_id=executed_exit_order.order_id, commission=executed_exit_order.commission,
-                            slippage_value=executed_exit_order.slippage
-                        )
-                        if active_sl_order_id_to_cancel: # Cancel the original SL order for this position
-                            sl_to_cancel = next((o for o in portfolio_manager.orders if o.order_id == active_sl_order_id_to_cancel and o.status=="pending"), None)
-                            if sl_to_cancel: sl_to_cancel.status = "cancelled"; sl_to_cancel.timestamp_filled = None
-                    except ValueError as e:
-                        print(f"Error closing position after TP for {symbol} at {timestamp}: {e}")
-
-        # Section 2.3: Process new entry signals (Donchian Channel breakouts)
-        if not emergency_stop_activated:
-            for symbol in config.get('markets', []):
-                if portfolio_manager.get_open_position(symbol): continue # Skip if already holding a position
-
-                if symbol not in processed_historical_data or timestamp not in processed_historical_data[symbol].index:
-                    continue # Skip if market data for this timestamp is missing
-
-                symbol_data_df = processed_historical_data[symbol]
-                current_close = symbol_data_df.loc[timestamp, 'Close']
-                if pd.isna(current_close): continue # Skip if close price is NaN
-
-                # Define expected column names for indicators
-                atr_col = f'atr_{atr_period_val}'
-                donchian_upper_entry_col = f'donchian_upper_entry_{entry_donchian_period_val}'
-                donchian_lower_entry_col = f'donchian_lower_entry_{entry_donchian_period_val}'
-
-                # Ensure required indicator data is present
-                if not all(col in symbol_data_df.columns for col in [atr_col, donchian_upper_entry_col, donchian_lower_entry_col]):
-                    continue # Skip if indicators are missing
-
-                # Generate entry signals (1 for long, -1 for short, 0 for no signal)
-                signal_series = generate_entry_signals(
-                    close=symbol_data_df['Close'],
-                    donchian_upper_entry=symbol_data_df[donchian_upper_entry_col],
-                    donchian_lower_entry=symbol_data_df[donchian_lower_entry_col],
-                    entry_period=entry_donchian_period_val
-                )
-                current_signal = signal_series.loc[timestamp] if timestamp in signal_series.index else 0
-                if pd.isna(current_signal): current_signal = 0
-
-                if current_signal == 1 or current_signal == -1: # If there's an entry signal
-                    # Calculate position size based on risk parameters
-                    account_equity = portfolio_manager.get_total_equity(current_prices)
-                    risk_percentage_per_trade = config['risk_per_trade'] / 100 if config['risk_per_trade'] >= 1 else config['risk_per_trade']
-                    current_atr = symbol_data_df.loc[timestamp, atr_col]
-                    if pd.isna(current_atr) or current_atr <= 0: continue # ATR must be valid
-
-                    # Ensure symbol-specific config items are present
-                    if not (symbol in config['pip_point_value'] and \
-                            symbol in config['lot_size'] and \
-                            symbol in config['max_units_per_market']):
-                        print(f"Warning: Missing symbol-specific config (pip_point_value, lot_size, or max_units_per_market) for {symbol}. Skipping entry.")
-                        continue
-
-                    pip_val_per_unit = config['pip_point_value'][symbol]
-                    lot_sz = config['lot_size'][symbol]
-                    pip_val_per_lot = pip_val_per_unit * lot_sz
-                    market_max_units = config['max_units_per_market'][symbol]
-                    current_total_risk_perc = portfolio_manager.get_current_total_open_risk_percentage()
-
-                    calculated_units = calculate_position_size(
-                        account_equity=account_equity, risk_percentage=risk_percentage_per_trade, atr=current_atr,
-                        pip_value_per_lot=pip_val_per_lot, lot_size=lot_sz,
-                        max_units_per_market=market_max_units, current_units_for_market=0, # No existing position for this symbol
-                        total_risk_percentage_limit=config['total_portfolio_risk_limit'],
-                        current_total_open_risk_percentage=current_total_risk_perc
+    # Loop-invariant configuration, bound once instead of re-indexing `config` per bar/order
+    markets = config.get('markets', [])
+    slippage_pips = config['slippage_pips']
+    commission_per_lot = config['commission_per_lot']
+    pip_point_values = config['pip_point_value']
+    lot_sizes = config['lot_size']
+    max_units_per_market = config['max_units_per_market']
+    # Markets with complete symbol-specific config; others are skipped (with a warning) at entry
+    symbol_risk_params = {
+        symbol: SymbolRiskParams(pip_point_values[symbol], lot_sizes[symbol], max_units_per_market[symbol])
+        for symbol in markets
+        if symbol in pip_point_values and symbol in lot_sizes and symbol in max_units_per_market
+    }
+    symbols_missing_config = set() # Markets whose skipped entries have already been logged
+    stop_loss_atr_multiplier = config['stop_loss_atr_multiplier']
+    if not stop_loss_atr_multiplier > 0:
+        raise ValueError("stop_loss_atr_multiplier must be positive.")
+    tile_size = config.get('backtest_tile_size', 50_000) # Bars per block of the main loop's dense matrices
+    if not isinstance(tile_size, int) or tile_size <= 0:
+        raise ValueError("backtest_tile_size must be a positive integer.")
+    # Opt-in float32 for the exit-band matrices: halves their memory traffic at the cost of ~7
+    # significant digits, so a close equal to a band may compare differently. ATR feeds stop
+    # distances and position sizing, so it stays float64 along with prices, stops and all
+    # cash/equity accounting.
+    indicator_dtype = np.float32 if config.get('use_fp32_indicators', False) else np.float64
+    results_stream_dir = config.get('results_stream_dir')
+    if results_stream_dir:
+        os.makedirs(results_stream_dir, exist_ok=True)
+        equity_curve_path = os.path.join(results_stream_dir, "equity_curve.csv")
+        trade_log_path = os.path.join(results_stream_dir, "trade_log.csv")
+    total_portfolio_risk_limit = config['total_portfolio_risk_limit']
+    risk_percentage_per_trade = config['risk_per_trade'] / 100 if config['risk_per_trade'] >= 1 else config['risk_per_trade']
+
+    # Per-slot inputs of the dense (bars x markets) matrices, with each symbol's own timestamps
+    n_markets = len(markets)
+    symbol_columns = {}
+    symbol_indexes_by_slot = {}
+    for slot, symbol in enumerate(markets):
+        if symbol in symbol_arrays:
+            symbol_columns[slot] = symbol_arrays[symbol]
+            symbol_indexes_by_slot[slot] = valid_historical_data[symbol].index
+    def _tile_rows(tile_index):
+        # Per slot: which tile bars the symbol has, and the symbol's own row for each of them.
+        # Resolved with one get_indexer call per symbol and tile, then shared by every matrix.
+        tile_rows = {}
+        for slot, symbol_index in symbol_indexes_by_slot.items():
+            source_rows = symbol_index.get_indexer(tile_index)
+            present = source_rows >= 0
+            tile_rows[slot] = (present, source_rows[present])
+        return tile_rows
+    def _aligned_matrix(column_name, tile_rows, tile_bars, dtype=np.float64):
+        # Dense (tile bars x markets) matrix, one column per configured market (the
+        # PortfolioManager symbol slots). Bars a symbol doesn't have are NaN.
+        matrix = np.full((tile_bars, n_markets), np.nan, dtype=dtype)
+        for slot, (present, source_rows) in tile_rows.items():
+            matrix[present, slot] = symbol_columns[slot][column_name][source_rows]
+        return matrix
+
+    # --- 2. Main Backtesting Loop: Iterate through event bars, one time tile at a time ---
+    # The matrices are only ever materialized for `backtest_tile_size` bars, which bounds memory on
+    # long, many-market timelines; bar timestamps are likewise only converted to Python objects one
+    # tile at a time. Indicators were computed on each symbol's full history above, so tiles need
+    # no warm-up overlap, and the portfolio carries over from one tile to the next.
+    # Within a tile, only bars on which a stop, exit or entry can fire are processed; the bars in
+    # between leave the portfolio unchanged, so their equity is marked to market in one vectorized
+    # step. Each event bar's Close row is converted to Python floats once so per-symbol scalar
+    # reads are plain list indexing.
+    n_bars = len(timeline_index)
+    # Equity at each bar, filled in place. When streaming, one tile-sized buffer is reused and
+    # flushed after every tile instead of holding the full timeline.
+    equity_values = np.empty(min(tile_size, n_bars) if results_stream_dir else n_bars, dtype=np.float64)
+    # Portfolio state read on every event bar, bound to locals once. The dicts are only ever
+    # mutated in place, and only configured markets trade here, so their array slots already
+    # exist and the market-slot views never go stale.
+    positions = portfolio_manager.positions
+    active_stops = portfolio_manager.active_stops
+    get_open_position = portfolio_manager.get_open_position
+    record_order = portfolio_manager.record_order
+    next_order_sequence = portfolio_manager.next_order_sequence
+    position_quantities = portfolio_manager.position_quantities[:n_markets]
+    stop_prices = portfolio_manager.stop_prices[:n_markets]
+    stop_sides = portfolio_manager.stop_sides[:n_markets]
+    for tile_start in range(0, n_bars, tile_size):
+        tile_index = timeline_index[tile_start:tile_start + tile_size]
+        tile_bars = len(tile_index)
+        tile_timestamps = tile_index.tolist()
+        tile_rows = _tile_rows(tile_index)
+        tile_equity = equity_values[:tile_bars] if results_stream_dir else equity_values[tile_start:tile_start + tile_bars]
+        close_matrix = _aligned_matrix('close', tile_rows, tile_bars)
+        high_matrix = _aligned_matrix('high', tile_rows, tile_bars)
+        low_matrix = _aligned_matrix('low', tile_rows, tile_bars)
+        atr_matrix = _aligned_matrix('atr', tile_rows, tile_bars)
+        stop_distance_matrix = stop_loss_atr_multiplier * atr_matrix # Initial stop offset from the entry close
+        # Comparisons against NaN are False, so missing bars never signal
+        entry_signal_matrix = np.nan_to_num(_aligned_matrix('entry_signal', tile_rows, tile_bars)).astype(np.int8)
+        # Donchian exits, as for generate_exit_signals: a long exits when the close falls below the
+        # previous long-exit lower band, a short when it rises above the previous short-exit upper band.
+        # Neither fires until both shifted exit bands are available.
+        prev_long_exit_lower_matrix = _aligned_matrix('prev_long_exit_lower', tile_rows, tile_bars, indicator_dtype)
+        prev_short_exit_upper_matrix = _aligned_matrix('prev_short_exit_upper', tile_rows, tile_bars, indicator_dtype)
+        exit_bands_ready = (prev_long_exit_lower_matrix == prev_long_exit_lower_matrix) & \
+                           (prev_short_exit_upper_matrix == prev_short_exit_upper_matrix)
+        long_exit_matrix = exit_bands_ready & (close_matrix < prev_long_exit_lower_matrix)
+        short_exit_matrix = exit_bands_ready & (close_matrix > prev_short_exit_upper_matrix)
+
+        row = 0 # Bar within the tile; `i` below is the bar on the full timeline
+        while row < tile_bars:
+            next_event_row = find_next_event_bar(
+                row, entry_signal_matrix, long_exit_matrix, short_exit_matrix, low_matrix, high_matrix,
+                position_quantities, stop_prices, stop_sides,
+                not emergency_stop_activated
+            )
+            if next_event_row > row:
+                tile_equity[row:next_event_row] = \
+                    portfolio_manager.get_total_equity_for_bars(close_matrix[row:next_event_row])
+                row = next_event_row
+                if row == tile_bars:
+                    break
+            i = tile_start + row
+
+            timestamp = tile_timestamps[row]
+            close_prices = close_matrix[row] # Per market slot; NaN where the symbol has no bar
+            close_row = close_prices.tolist()
+
+            # Record equity at each step, marked to market from the position arrays
+            tile_equity[row] = portfolio_manager.get_total_equity_at(close_prices, i)
+
+            # --- Trading Logic Sections ---
+
+            # Section 2.1: Process pending stop-loss orders
+            # Only the active stop per symbol can trigger; the kernel checks all market slots at once
+            # (missing bars are NaN and never trigger).
+            if active_stops:
+                triggered_slots = find_stop_triggers(low_matrix[row], high_matrix[row], stop_prices, stop_sides)
+            else:
+                triggered_slots = ()
+            for slot in triggered_slots:
+                symbol = markets[slot]
+                stop_order = active_stops[symbol]
+                if stop_order.status == "pending":
+                    # Execute the triggered stop order
+                    executed_order = execute_order(
+                        order=stop_order, current_market_price=stop_order.order_price,
+                        slippage_pips=slippage_pips, commission_per_lot=commission_per_lot,
+                        pip_point_value=symbol_risk_params[symbol].pip_value_per_unit, lot_size=symbol_risk_params[symbol].lot_size,
+                        timestamp_filled_param=timestamp
                     )
-
-                    if calculated_units > 0:
-                        # Determine trade action and stop-loss price
-                        stop_loss_atr_multiplier = config['stop_loss_atr_multiplier']
-                        trade_action = "buy" if current_signal == 1 else "sell"
-                        stop_loss_price = current_close - (stop_loss_atr_multiplier * current_atr) if trade_action == "buy" \
-                                     else current_close + (stop_loss_atr_multiplier * current_atr)
-
-                        # Create and execute market order for entry
-                        entry_order_id = f"{timestamp.strftime('%Y%m%d%H%M%S')}_{symbol}_ENTRY"
-                        entry_market_order = Order(
-                            order_id=entry_order_id, symbol=symbol, order_type="market",
-                            trade_action=trade_action, quantity=calculated_units
-                        )
-                        portfolio_manager.record_order(entry_market_order)
-                        executed_entry_order = execute_order(
-                            order=entry_market_order, current_market_price=current_close,
-                            slippage_pips=config['slippage_pips'], commission_per_lot=config['commission_per_lot'],
-                            pip_point_value=pip_val_per_unit, lot_size=lot_sz,
-                            timestamp_filled_param=timestamp
+                    if executed_order.status == "filled":
+                        try:
+                            # Close the position in portfolio manager
+                            portfolio_manager.close_position_completely(
+                                symbol=symbol, exit_price=executed_order.fill_price,
+                                exit_time=executed_order.timestamp_filled or timestamp,
+                                order_id=executed_order.order_id, commission=executed_order.commission,
+                                slippage_value=executed_order.slippage
+                            )
+                            # Future enhancement: Cancel any corresponding take-profit order for this position.
+                        except ValueError as e:
+                            trading_logger.error("Error closing position after SL for %s at %s: %s", symbol, timestamp, e)
+
+            # Section 2.2: Process take-profit signals (Donchian Channel exits)
+            # Only walk the positions when some held slot's exit condition fires on this bar
+            exit_due = ((position_quantities > 0) & long_exit_matrix[row]) | ((position_quantities < 0) & short_exit_matrix[row])
+            for symbol in (list(positions) if exit_due.any() else ()): # Iterate on a copy of keys for safe removal
+                position = get_open_position(symbol)
+                if not position: continue # Position might have been closed by SL
+
+                slot = portfolio_manager.symbol_index.get(symbol)
+                if slot is None or slot >= n_markets: continue
+                current_close = close_row[slot] # Exit conditions are False where the symbol has no bar (NaN)
+
+                take_profit_triggered = False
+                trade_action_on_exit = ""
+                if position.quantity > 0 and long_exit_matrix[row, slot]: # Long exit
+                    take_profit_triggered = True; trade_action_on_exit = "sell"
+                elif position.quantity < 0 and short_exit_matrix[row, slot]: # Short exit
+                    take_profit_triggered = True; trade_action_on_exit = "buy"
+
+                if take_profit_triggered:
+                    tp_order_id = f"{next_order_sequence()}_{symbol}_TP"
+                    market_exit_order = Order( # Create a market order to exit
+                        order_id=tp_order_id, symbol=symbol, order_type="market",
+                        trade_action=trade_action_on_exit, quantity=abs(position.quantity),
+                        timestamp_created=timestamp
+                    )
+                    record_order(market_exit_order)
+                    # Execute the take-profit market order
+                    executed_exit_order = execute_order(
+                        order=market_exit_order, current_market_price=current_close,
+                        slippage_pips=slippage_pips, commission_per_lot=commission_per_lot,
+                        pip_point_value=symbol_risk_params[symbol].pip_value_per_unit, lot_size=symbol_risk_params[symbol].lot_size,
+                        timestamp_filled_param=timestamp
+                    )
+                    if executed_exit_order.status == "filled":
+                        try:
+                            sl_to_cancel = active_stops.get(symbol)
+                            # Close position in portfolio manager
+                            portfolio_manager.close_position_completely(
+                                symbol=symbol, exit_price=executed_exit_order.fill_price,
+                                exit_time=executed_exit_order.timestamp_filled or timestamp,
+                                order_id=executed_exit_order.order_id, commission=executed_exit_order.commission,
+                                slippage_value=executed_exit_order.slippage
+                            )
+                            if sl_to_cancel is not None and sl_to_cancel.status == "pending": # Cancel the original SL order for this position
+                                sl_to_cancel.status = "cancelled"; sl_to_cancel.timestamp_filled = None
+                        except ValueError as e:
+                            trading_logger.error("Error closing position after TP for %s at %s: %s", symbol, timestamp, e)
+
+            # Section 2.3: Process new entry signals (Donchian Channel breakouts)
+            if not emergency_stop_activated:
+                current_total_risk_perc = None # Fetched lazily, only once a sizable signal needs it
+                # Candidate slots: a non-zero signal on a flat slot, read from the signal row and the
+                # position quantity array rather than a position dict lookup per market. Opening a
+                # position only affects its own slot, so the candidates stay valid through the loop.
+                flat_slots = position_quantities == 0
+                for slot in np.flatnonzero(entry_signal_matrix[row] * flat_slots).tolist():
+                    symbol = markets[slot]
+                    current_close = close_row[slot]
+                    if current_close != current_close: continue # Skip if market data for this timestamp is missing (NaN)
+
+                    # Entry signal for this bar (1 for long, -1 for short, 0 for no signal)
+                    current_signal = int(entry_signal_matrix[row, slot])
+
+                    if current_signal == 1 or current_signal == -1: # If there's an entry signal
+                        current_atr = float(atr_matrix[row, slot])
+                        if current_atr != current_atr or current_atr <= 0: continue # ATR must be valid (not NaN, positive)
+
+                        # Ensure symbol-specific config items are present
+                        risk_params = symbol_risk_params.get(symbol)
+                        if risk_params is None:
+                            if symbol not in symbols_missing_config: # Warn once per symbol, not on every signal
+                                symbols_missing_config.add(symbol)
+                                trading_logger.warning("Missing symbol-specific config (pip_point_value, lot_size, or max_units_per_market) for %s. Skipping its entries.", symbol)
+                            continue
+
+                        pip_val_per_unit = risk_params.pip_value_per_unit
+                        lot_sz = risk_params.lot_size
+                        pip_val_per_lot = risk_params.pip_value_per_lot
+                        market_max_units = risk_params.max_units
+                        if current_total_risk_perc is None: # Open risk only changes when an entry fills below
+                            current_total_risk_perc = portfolio_manager.get_current_total_open_risk_percentage()
+
+                        # Calculate position size based on risk parameters
+                        account_equity = portfolio_manager.get_total_equity_at(close_prices, i) # Reflects exits earlier in this bar
+
+                        calculated_units = calculate_position_size(
+                            account_equity=account_equity, risk_percentage=risk_percentage_per_trade, atr=current_atr,
+                            pip_value_per_lot=pip_val_per_lot, lot_size=lot_sz,
+                            max_units_per_market=market_max_units, current_units_for_market=0, # No existing position for this symbol
+                            total_risk_percentage_limit=total_portfolio_risk_limit,
+                            current_total_open_risk_percentage=current_total_risk_perc
                         )
-                        if executed_entry_order.status == "filled":
-                            try:
-                                # Open position in portfolio manager
-                                portfolio_manager.open_position(
-                                    symbol=symbol, trade_action=executed_entry_order.trade_action,
-                                    quantity=executed_entry_order.quantity, entry_price=executed_entry_order.fill_price,
-                                    entry_time=executed_entry_order.timestamp_filled or timestamp,
-                                    stop_loss_price=stop_loss_price, order_id=executed_entry_order.order_id,
-                                    commission=executed_entry_order.commission, slippage_value=executed_entry_order.slippage
-                                )
-                            except ValueError as e: # Catch errors from open_position (e.g. opposing trade)
-                                print(f"Error opening position for {symbol} at {timestamp}: {e}")
-        # else: # Optional: could add a log here if desired, e.g.
-            # if timestamp == sorted_timestamps[0]: # Log once per backtest if stopped
-            #     print(f"INFO: Emergency stop is active. Skipping new entry signal processing for all markets.")
-            # pass # No new entries are processed
+
+                        if calculated_units > 0:
+                            # Determine trade action and stop-loss price (below the close for longs, above for shorts)
+                            trade_action = "buy" if current_signal == 1 else "sell"
+                            stop_loss_price = current_close - current_signal * float(stop_distance_matrix[row, slot])
+
+                            # Create and execute market order for entry
+                            entry_order_id = f"{next_order_sequence()}_{symbol}_ENTRY"
+                            entry_market_order = Order(
+                                order_id=entry_order_id, symbol=symbol, order_type="market",
+                                trade_action=trade_action, quantity=calculated_units,
+                                timestamp_created=timestamp
+                            )
+                            record_order(entry_market_order)
+                            executed_entry_order = execute_order(
+                                order=entry_market_order, current_market_price=current_close,
+                                slippage_pips=slippage_pips, commission_per_lot=commission_per_lot,
+                                pip_point_value=pip_val_per_unit, lot_size=lot_sz,
+                                timestamp_filled_param=timestamp
+                            )
+                            if executed_entry_order.status == "filled":
+                                try:
+                                    # Open position in portfolio manager
+                                    portfolio_manager.open_position(
+                                        symbol=symbol, trade_action=executed_entry_order.trade_action,
+                                        quantity=executed_entry_order.quantity, entry_price=executed_entry_order.fill_price,
+                                        entry_time=executed_entry_order.timestamp_filled or timestamp,
+                                        stop_loss_price=stop_loss_price, order_id=executed_entry_order.order_id,
+                                        commission=executed_entry_order.commission, slippage_value=executed_entry_order.slippage
+                                    )
+                                    current_total_risk_perc = None # The new stop adds open risk
+                                except ValueError as e: # Catch errors from open_position (e.g. opposing trade)
+                                    trading_logger.error("Error opening position for %s at %s: %s", symbol, timestamp, e)
+
+            row += 1
+
+        if results_stream_dir: # Flush this tile's equity and the trades executed in it
+            _append_results_csv(equity_curve_path, {"timestamp": tile_index, "equity": tile_equity},
+                                EQUITY_CURVE_COLUMNS, write_header=tile_start == 0)
+            _append_results_csv(trade_log_path, portfolio_manager.trade_log.to_dataframe(), TRADE_LOG_COLUMNS, write_header=tile_start == 0)
+            portfolio_manager.trade_log.clear()
 
     # --- 3. Return Results of the Backtest ---
+    if results_stream_dir:
+        return {
+            "equity_curve": [],
+            "trade_log": TradeLog(),
+            "equity_curve_path": equity_curve_path,
+            "trade_log_path": trade_log_path,
+            "final_capital": portfolio_manager.capital,
+            "portfolio_summary": {
+                "initial_capital": portfolio_manager.initial_capital,
+                "final_equity": float(tile_equity[-1]),
+                "total_trades": portfolio_manager.trade_count,
+            }
+        }
+    equity_curve = list(zip(timeline_index.tolist(), equity_values.tolist())) # (timestamp, equity) tuples
     return {
         "equity_curve": equity_curve,
         "trade_log": portfolio_manager.trade_log,
         "final_capital": portfolio_manager.capital,
         "portfolio_summary": { # Optional: more details
             "initial_capital": portfolio_manager.initial_capital,
-            "final_equity": equity_curve[-1][1] if equity_curve else initial_capital,
-            "total_trades": len(portfolio_manager.trade_log),
+            "final_equity": float(equity_values[-1]) if n_bars else initial_capital,
+            "total_trades": portfolio_manager.trade_count,
             # Add more summary stats as needed
         }
     }
 
+def _run_strategy_subset(task: Tuple[Dict[str, pd.DataFrame], float, Dict, bool]) -> Dict:
+    """Runs `run_strategy` for one instrument subset (module-level so worker processes can unpickle it)."""
+    historical_data_subset, subset_capital, subset_config, emergency_stop_activated = task
+    return run_strategy(historical_data_subset, subset_capital, subset_config, emergency_stop_activated)
+
+def run_strategy_parallel(historical_data_dict: Dict[str, pd.DataFrame], initial_capital: float, config: Dict,
+                          emergency_stop_activated: bool = False, max_workers: Optional[int] = None) -> Dict:
+    """
+    Runs the backtest as independent instrument subsets in parallel worker processes.
+
+    `config['markets']` is split round-robin into up to `max_workers` subsets. Each subset is
+    backtested by `run_strategy` in its own process with an equal share of `initial_capital`,
+    and the results are combined: trade logs are merged in time order, and equity curves are
+    aligned on the union of all timestamps (each subset's equity carried forward) and summed.
+
+    Limitation: risk is coupled only within a subset. Position sizing uses the subset's own
+    equity, and `total_portfolio_risk_limit` caps each subset separately, so results differ from
+    a single `run_strategy` call over all markets whenever those cross-market constraints bind.
+
+    Args:
+        historical_data_dict (dict[str, pd.DataFrame]): Price data per symbol, as for `run_strategy`.
+        initial_capital (float): Total starting capital, split evenly across subsets.
+        config (dict): Strategy configuration, as for `run_strategy`.
+        emergency_stop_activated (bool, optional): If True, new trade entries are disabled.
+                                                 Defaults to False.
+        max_workers (Optional[int], optional): Maximum number of worker processes.
+                                               Defaults to the number of CPUs.
+
+    Returns:
+        dict: Combined results with the same keys as `run_strategy`; "trade_log" is a
+              `TradeLog` holding every subset's trades in time order.
+    """
+    if config.get('results_stream_dir'):
+        raise ValueError("results_stream_dir is not supported by run_strategy_parallel; use run_strategy.")
+    markets = list(config.get('markets', []))
+    n_subsets = max(1, min(max_workers or os.cpu_count() or 1, len(markets)))
+    if n_subsets == 1:
+        return run_strategy(historical_data_dict, initial_capital, config, emergency_stop_activated)
+
+    subset_capital = initial_capital / n_subsets
+    tasks = []
+    for k in range(n_subsets):
+        subset_markets = markets[k::n_subsets]
+        subset_config = dict(config, markets=subset_markets)
+        subset_data = {symbol: historical_data_dict[symbol] for symbol in subset_markets if symbol in historical_data_dict}
+        tasks.append((subset_data, subset_capital, subset_config, emergency_stop_activated))
+
+    # Worker processes are spawned rather than forked: a fork taken while Numba's worker
+    # threads are running can deadlock in the child.
+    with ProcessPoolExecutor(max_workers=n_subsets, mp_context=multiprocessing.get_context("spawn")) as executor:
+        subset_results = list(executor.map(_run_strategy_subset, tasks))
+
+    # Combined equity over the full timeline; before a subset's first bar its equity is its starting capital
+    symbol_indexes = [df.index for df in historical_data_dict.values() if isinstance(df, pd.DataFrame) and not df.empty]
+    timeline_index = symbol_indexes[0].append(symbol_indexes[1:]).unique().sort_values() if symbol_indexes else pd.Index([])
+    total_equity = np.zeros(len(timeline_index))
+    for result in subset_results:
+        curve = result.get("equity_curve") or []
+        subset_equity = pd.Series([equity for _, equity in curve], index=pd.Index([ts for ts, _ in curve]), dtype=np.float64)
+        total_equity += subset_equity.reindex(timeline_index).ffill().fillna(subset_capital).to_numpy()
+
+    trade_log = TradeLog()
+    for trade in sorted((trade for result in subset_results for trade in result["trade_log"]),
+                        key=lambda trade: trade["timestamp"]): # Stable: same-time trades keep subset order
+        trade_log.append(trade)
+    final_capital = sum(result["final_capital"] for result in subset_results)
+    return {
+        "equity_curve": list(zip(timeline_index.tolist(), total_equity.tolist())),
+        "trade_log": trade_log,
+        "final_capital": final_capital,
+        "portfolio_summary": {
+            "initial_capital": initial_capital,
+            "final_equity": float(total_equity[-1]) if len(total_equity) else initial_capital,
+            "total_trades": sum(result["portfolio_summary"]["total_trades"] for result in subset_results),
+            "subsets": [list(markets[k::n_subsets]) for k in range(n_subsets)],
+        }
+    }
+
+# Price data shared by every task of a `run_strategies` worker, set once per process by its initializer
+_sweep_historical_data: Dict[str, pd.DataFrame] = {}
+
+def _init_sweep_worker(historical_data_dict: Dict[str, pd.DataFrame]):
+    """Worker initializer for `run_strategies`: keeps the price data so it is unpickled once per process."""
+    global _sweep_historical_data
+    _sweep_historical_data = historical_data_dict
+
+def _run_strategy_sweep_task(task: Tuple[float, Dict, bool]) -> Dict:
+    """Runs `run_strategy` for one sweep configuration on the worker's shared price data."""
+    initial_capital, config, emergency_stop_activated = task
+    return run_strategy(_sweep_historical_data, initial_capital, config, emergency_stop_activated)
+
+def run_strategies(historical_data_dict: Dict[str, pd.DataFrame], initial_capital: float, configs: List[Dict],
+                   emergency_stop_activated: bool = False, max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    Runs one independent backtest per configuration (e.g. a parameter sweep) in parallel worker processes.
+
+    Each configuration is passed to `run_strategy` unchanged, with the same price data and
+    starting capital, so every result is identical to a sequential `run_strategy` call. The price
+    data is sent to each worker process once (not once per configuration).
+
+    Args:
+        historical_data_dict (dict[str, pd.DataFrame]): Price data per symbol, as for `run_strategy`.
+        initial_capital (float): Starting capital of every backtest.
+        configs (list[dict]): Strategy configurations, as for `run_strategy`. Configurations that
+                              set `results_stream_dir` must each use a different directory.
+        emergency_stop_activated (bool, optional): If True, new trade entries are disabled.
+                                                 Defaults to False.
+        max_workers (Optional[int], optional): Maximum number of worker processes.
+                                               Defaults to the number of CPUs.
+
+    Returns:
+        list[dict]: The `run_strategy` results, in the order of `configs`.
+    """
+    configs = list(configs)
+    stream_dirs = [config['results_stream_dir'] for config in configs if config.get('results_stream_dir')]
+    if len(set(stream_dirs)) != len(stream_dirs):
+        raise ValueError("Each configuration passed to run_strategies needs its own results_stream_dir.")
+    n_workers = max(1, min(max_workers or os.cpu_count() or 1, len(configs)))
+    if n_workers == 1:
+        return [run_strategy(historical_data_dict, initial_capital, config, emergency_stop_activated) for config in configs]
+
+    tasks = [(initial_capital, config, emergency_stop_activated) for config in configs]
+    # Spawned, not forked, for the same reason as in run_strategy_parallel
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_sweep_worker, initargs=(historical_data_dict,)) as executor:
+        return list(executor.map(_run_strategy_sweep_task, tasks))
+
+def _donchian_segments(high, low, segment_bounds, period, upper, lower):
+    """
+    Rolling `period` max of `high` / min of `low` for independent series stored back to back.
+
+    Series m occupies [segment_bounds[m], segment_bounds[m + 1]). Segments are processed in
+    parallel; each one writes only its own slice of `upper`/`lower`. As with pandas
+    `rolling(period, min_periods=period)`, a window that is incomplete or contains NaN yields NaN.
+
+    Each segment is a single O(N) pass: monotonic deques of bar indices keep the window's
+    running max (decreasing highs) and min (increasing lows) at their heads, so every bar is
+    pushed and popped at most once regardless of `period`.
+    """
+    for m in prange(segment_bounds.shape[0] - 1):
+        start = segment_bounds[m]
+        end = segment_bounds[m + 1]
+        max_deque = np.empty(end - start, dtype=np.int64)
+        min_deque = np.empty(end - start, dtype=np.int64)
+        max_head = 0
+        max_tail = 0
+        min_head = 0
+        min_tail = 0
+        last_high_nan = start - period # Most recent NaN high/low; a window containing it is NaN
+        last_low_nan = start - period
+        for t in range(start, end):
+            h = high[t]
+            if h != h:
+                last_high_nan = t
+            else:
+                while max_tail > max_head and high[max_deque[max_tail - 1]] <= h:
+                    max_tail -= 1
+                max_deque[max_tail] = t
+                max_tail += 1
+            lo = low[t]
+            if lo != lo:
+                last_low_nan = t
+            else:
+                while min_tail > min_head and low[min_deque[min_tail - 1]] >= lo:
+                    min_tail -= 1
+                min_deque[min_tail] = t
+                min_tail += 1
+
+            window_start = t - period + 1
+            while max_tail > max_head and max_deque[max_head] < window_start:
+                max_head += 1
+            while min_tail > min_head and min_deque[min_head] < window_start:
+                min_head += 1
+
+            if window_start < start: # Incomplete window
+                upper[t] = np.nan
+                lower[t] = np.nan
+                continue
+            upper[t] = np.nan if last_high_nan >= window_start else high[max_deque[max_head]]
+            lower[t] = np.nan if last_low_nan >= window_start else low[min_deque[min_head]]
+
+_donchian_segments_kernel = njit(parallel=True, cache=True)(_donchian_segments)
+# Numba's default (workqueue) threading layer must not be entered from more than one thread, and
+# backtests launched by the backend run in worker threads, so those use the serial compilation.
+# It is not cached: both dispatchers wrap the same function and would share (and could load
+# each other's) on-disk cache entries. It releases the GIL, so concurrent backtests (and the
+# API's own threads) keep running while one thread is inside the kernel.
+_donchian_segments_kernel_serial = njit(nogil=True)(_donchian_segments)
+
+def _segment_kernel(parallel_kernel, serial_kernel):
+    """Picks the parallel compilation of a per-segment kernel on the main thread, else the serial one."""
+    return parallel_kernel if threading.current_thread() is threading.main_thread() else serial_kernel
+
+def _donchian_bands_by_segment(high_values, low_values, segment_bounds, period):
+    """
+    Computes Donchian bands for several series concatenated into flat arrays.
+
+    Args:
+        high_values (np.ndarray): float64 highs of all series, back to back.
+        low_values (np.ndarray): float64 lows of all series, back to back.
+        segment_bounds (np.ndarray): int64 offsets; series m is [bounds[m], bounds[m + 1]).
+        period (int): Lookback period.
+
+    Returns:
+        tuple: upper_band (np.ndarray), lower_band (np.ndarray), aligned with the inputs.
+    """
+    upper = np.empty_like(high_values)
+    lower = np.empty_like(low_values)
+    if NUMBA_AVAILABLE:
+        kernel = _segment_kernel(_donchian_segments_kernel, _donchian_segments_kernel_serial)
+        kernel(high_values, low_values, segment_bounds, period, upper, lower)
+    else: # Without Numba the pandas rolling window is faster than the kernel run as plain Python
+        for start, end in zip(segment_bounds[:-1], segment_bounds[1:]):
+            upper[start:end] = pd.Series(high_values[start:end]).rolling(window=period, min_periods=period).max().to_numpy()
+            lower[start:end] = pd.Series(low_values[start:end]).rolling(window=period, min_periods=period).min().to_numpy()
+    return upper, lower
+
 def calculate_donchian_channel(high, low, period):
     """Calculates the Donchian Channel.
 
@@ -940,11 +1746,100 @@ def calculate_donchian_channel(high, low, period):
     if period <= 0:
         raise ValueError("Period must be a positive integer.")
 
-    upper_band = high.rolling(window=period, min_periods=period).max()
-    lower_band = low.rolling(window=period, min_periods=period).min()
+    upper_values, lower_values = _donchian_bands_by_segment(
+        high.to_numpy(dtype=np.float64), low.to_numpy(dtype=np.float64),
+        np.array([0, len(high)], dtype=np.int64), period
+    )
+    upper_band = pd.Series(upper_values, index=high.index, name=high.name)
+    lower_band = pd.Series(lower_values, index=low.index, name=low.name)
     return upper_band, lower_band
 
-def calculate_atr(high, low, close, period):
+def _atr_segments(high, low, close, segment_bounds, period, wilder, true_range, atr):
+    """
+    True Range (and, if `wilder`, Wilder's ATR) for independent series stored back to back.
+
+    Series m occupies [segment_bounds[m], segment_bounds[m + 1]); segments are processed in
+    parallel. TR = max(high - low, |high - previous close|, |low - previous close|) and is NaN
+    on a segment's first bar (no previous close) and wherever an input is NaN. Wilder's ATR
+    is seeded with the mean of the first `period` TR values, then each bar adds
+    (tr - previous atr) / period (alpha = 1 / period); a NaN TR yields NaN and restarts the seed.
+    """
+    for m in prange(segment_bounds.shape[0] - 1):
+        start = segment_bounds[m]
+        end = segment_bounds[m + 1]
+        seed_sum = 0.0
+        seed_count = 0
+        prev_atr = np.nan
+        for t in range(start, end):
+            if t == start:
+                tr = np.nan
+            else:
+                h = high[t]
+                lo = low[t]
+                prev_close = close[t - 1]
+                if h != h or lo != lo or prev_close != prev_close:
+                    tr = np.nan
+                else:
+                    tr = max(h - lo, abs(h - prev_close), abs(lo - prev_close))
+            true_range[t] = tr
+            if not wilder:
+                continue
+            if tr != tr:
+                atr[t] = np.nan
+                seed_sum = 0.0
+                seed_count = 0
+                prev_atr = np.nan
+            elif seed_count < period:
+                seed_sum += tr
+                seed_count += 1
+                if seed_count == period:
+                    prev_atr = seed_sum / period
+                atr[t] = prev_atr # NaN until the seeding window is complete
+            else:
+                prev_atr = prev_atr + (tr - prev_atr) / period
+                atr[t] = prev_atr
+
+_atr_segments_kernel = njit(parallel=True, cache=True)(_atr_segments)
+_atr_segments_kernel_serial = njit(nogil=True)(_atr_segments) # Not cached, see _donchian_segments_kernel_serial
+
+def _atr_by_segment(high_values, low_values, close_values, segment_bounds, period, smoothing):
+    """
+    Computes the ATR for several series concatenated into flat arrays.
+
+    Args:
+        high_values (np.ndarray): float64 highs of all series, back to back.
+        low_values (np.ndarray): float64 lows of all series, back to back.
+        close_values (np.ndarray): float64 closes of all series, back to back.
+        segment_bounds (np.ndarray): int64 offsets; series m is [bounds[m], bounds[m + 1]).
+        period (int): Lookback period.
+        smoothing (str): "sma" or "wilder" (see `calculate_atr`).
+
+    Returns:
+        np.ndarray: ATR values aligned with the inputs.
+    """
+    wilder = smoothing == "wilder"
+    true_range = np.empty_like(high_values)
+    atr = np.empty_like(high_values)
+    if NUMBA_AVAILABLE:
+        kernel = _segment_kernel(_atr_segments_kernel, _atr_segments_kernel_serial)
+        kernel(high_values, low_values, close_values, segment_bounds, period, wilder, true_range, atr)
+    elif wilder: # Plain-Python fallback; the SMA path below only needs the True Range
+        _atr_segments(high_values, low_values, close_values, segment_bounds, period, wilder, true_range, atr)
+    else:
+        for start, end in zip(segment_bounds[:-1], segment_bounds[1:]):
+            high_seg, low_seg = high_values[start:end], low_values[start:end]
+            previous_close = np.concatenate((np.full(min(1, end - start), np.nan), close_values[start:max(start, end - 1)]))
+            # np.maximum propagates NaN, so bars with a missing input get a NaN TR
+            true_range[start:end] = np.maximum(np.maximum(high_seg - low_seg, np.abs(high_seg - previous_close)),
+                                               np.abs(low_seg - previous_close))
+    if not wilder:
+        # Simple Moving Average of the True Range, NaN until `period` TR values are available
+        # (min_periods=period), which is the standard for ATR.
+        for start, end in zip(segment_bounds[:-1], segment_bounds[1:]):
+            atr[start:end] = pd.Series(true_range[start:end]).rolling(window=period, min_periods=period).mean().to_numpy()
+    return atr
+
+def calculate_atr(high, low, close, period, smoothing="sma"):
     """Calculates the Average True Range (ATR).
 
     Args:
@@ -952,6 +1847,9 @@ def calculate_atr(high, low, close, period):
         low (pd.Series): Series of low prices.
         close (pd.Series): Series of close prices.
         period (int): Lookback period for ATR calculation.
+        smoothing (str, optional): "sma" for a simple moving average of the True Range,
+                                   "wilder" for Wilder's smoothing (alpha = 1 / period)
+                                   seeded with the first full SMA. Defaults to "sma".
 
     Returns:
         pd.Series: ATR values.
@@ -963,43 +1861,115 @@ def calculate_atr(high, low, close, period):
 
     if period <= 0:
         raise ValueError("Period must be a positive integer.")
+    if smoothing not in ("sma", "wilder"):
+        raise ValueError("ATR smoothing must be 'sma' or 'wilder'.")
 
-    # Calculate True Range (TR)
-    # TR = max(high - low, abs(high - previous_close), abs(low - previous_close))
+    atr_values = _atr_by_segment(
+        high.to_numpy(dtype=np.float64), low.to_numpy(dtype=np.float64), close.to_numpy(dtype=np.float64),
+        np.array([0, len(high)], dtype=np.int64), period, smoothing
+    )
+    atr = pd.Series(atr_values, index=high.index)
 
-    # Shift close prices to get previous_close
-    previous_close = close.shift(1)
+    return atr
 
-    # Component 1: high - low
-    tr1 = high - low
 
-    # Component 2: abs(high - previous_close)
-    tr2 = abs(high - previous_close)
+@njit(cache=True, nogil=True)
+def _breakout_signal_kernel(close, upper_entry, lower_entry, upper_exit, lower_exit, positions):
+    """
+    Entry and exit signals in one pass over raw arrays.
 
-    # Component 3: abs(low - previous_close)
-    tr3 = abs(low - previous_close)
+    Each bar's close is compared against the previous bar's bands. Entry: 1 when the close
+    breaks above the entry upper band, -1 when it breaks below the entry lower band. Exit: -1
+    when holding long (positions == 1) and the close falls below the exit lower band, 1 when
+    holding short (positions == -1) and it rises above the exit upper band. NaN bands never signal.
+    """
+    n = close.shape[0]
+    entry_signal = np.zeros(n, dtype=np.int8)
+    exit_signal = np.zeros(n, dtype=np.int8)
+    for t in range(1, n):
+        c = close[t]
+        if c > upper_entry[t - 1]:
+            entry_signal[t] = 1
+        if c < lower_entry[t - 1]:
+            entry_signal[t] = -1
+        held = positions[t]
+        if held == 1:
+            if c < lower_exit[t - 1]:
+                exit_signal[t] = -1
+        elif held == -1:
+            if c > upper_exit[t - 1]:
+                exit_signal[t] = 1
+    return entry_signal, exit_signal
+
+def _breakout_signals(close, upper_entry, lower_entry, upper_exit, lower_exit, positions):
+    """
+    Computes entry and exit signals for aligned float64 arrays (see `_breakout_signal_kernel`).
 
-    # True Range is the maximum of these three components
-    # Use a DataFrame to handle NaNs correctly during max(axis=1)
-    tr_df = pd.DataFrame({'tr1': tr1, 'tr2': tr2, 'tr3': tr3})
-    true_range = tr_df.max(axis=1, skipna=False)
+    Returns:
+        tuple: entry_signal (np.ndarray of int8), exit_signal (np.ndarray of int8).
+    """
+    if NUMBA_AVAILABLE:
+        return _breakout_signal_kernel(close, upper_entry, lower_entry, upper_exit, lower_exit, positions)
+    # Without Numba, the same comparisons as whole-array NumPy operations. Bar k is compared with
+    # the bands of bar k-1 through offset slice views, so no shifted copies are allocated; bar 0
+    # has no previous band and stays 0.
+    current_close = close[1:]
+    entry_signal = np.zeros(len(close), dtype=np.int8)
+    entry_signal[1:] = (current_close > upper_entry[:-1]).astype(np.int8) - (current_close < lower_entry[:-1])
+    exit_signal = np.zeros(len(close), dtype=np.int8)
+    exit_signal[1:] = (((positions[1:] == -1) & (current_close > upper_exit[:-1])).astype(np.int8)
+                       - ((positions[1:] == 1) & (current_close < lower_exit[:-1])))
+    return entry_signal, exit_signal
+
+def _entry_signal_segments(close, upper_entry, lower_entry, segment_bounds, entry_signal):
+    """
+    Donchian breakout entry signals for independent series stored back to back.
 
-    # Handle the first TR value which will be NaN due to previous_close.
-    # Some ATR definitions set the first TR to (high - low) of the first period.
-    # However, consistent with rolling calculations, it's fine to let it be NaN
-    # and have the rolling mean handle it. Or, we can fill the first TR specifically.
-    # For simplicity, we let the rolling mean handle it.
-    # If high, low, close are of length N, true_range will be length N with first element NaN.
+    Series m occupies [segment_bounds[m], segment_bounds[m + 1]); segments are processed in
+    parallel. As in `_breakout_signal_kernel`, each close is compared with the previous bar's
+    bands of the same series, so a segment's first bar never signals.
+    """
+    for m in prange(segment_bounds.shape[0] - 1):
+        start = segment_bounds[m]
+        end = segment_bounds[m + 1]
+        if end > start:
+            entry_signal[start] = 0
+        for t in range(start + 1, end):
+            c = close[t]
+            if c < lower_entry[t - 1]:
+                entry_signal[t] = -1
+            elif c > upper_entry[t - 1]:
+                entry_signal[t] = 1
+            else:
+                entry_signal[t] = 0
 
-    # Calculate ATR as the Simple Moving Average (SMA) of True Range
-    # min_periods=0 ensures that it calculates even if there are fewer than 'period' non-NaN values,
-    # which can happen at the beginning of the series.
-    # However, for ATR, it's more standard to have NaNs until enough data is available.
-    # So, we'll use min_periods=period.
-    atr = true_range.rolling(window=period, min_periods=period).mean()
+_entry_signal_segments_kernel = njit(parallel=True, cache=True)(_entry_signal_segments)
+_entry_signal_segments_kernel_serial = njit(nogil=True)(_entry_signal_segments) # Not cached, see _donchian_segments_kernel_serial
 
-    return atr
+def _entry_signals_by_segment(close_values, upper_values, lower_values, segment_bounds):
+    """
+    Computes entry signals for several series concatenated into flat arrays.
 
+    Args:
+        close_values (np.ndarray): float64 closes of all series, back to back.
+        upper_values (np.ndarray): float64 entry Donchian upper bands, aligned with the closes.
+        lower_values (np.ndarray): float64 entry Donchian lower bands, aligned with the closes.
+        segment_bounds (np.ndarray): int64 offsets; series m is [bounds[m], bounds[m + 1]).
+
+    Returns:
+        np.ndarray: int8 signals (1 for long, -1 for short, 0 for no signal), aligned with the inputs.
+    """
+    entry_signal = np.empty(len(close_values), dtype=np.int8)
+    if NUMBA_AVAILABLE:
+        kernel = _segment_kernel(_entry_signal_segments_kernel, _entry_signal_segments_kernel_serial)
+        kernel(close_values, upper_values, lower_values, segment_bounds, entry_signal)
+    else:
+        for start, end in zip(segment_bounds[:-1], segment_bounds[1:]):
+            entry_signal[start:end], _ = _breakout_signals(
+                close_values[start:end], upper_values[start:end], lower_values[start:end],
+                upper_values[start:end], lower_values[start:end], np.zeros(end - start)
+            )
+    return entry_signal
 
 def generate_entry_signals(close, donchian_upper_entry, donchian_lower_entry, entry_period):
     """
@@ -1019,35 +1989,18 @@ def generate_entry_signals(close, donchian_upper_entry, donchian_lower_entry, en
         raise TypeError("Inputs close, donchian_upper_entry, donchian_lower_entry must be pandas Series.")
     if not isinstance(entry_period, int) or entry_period <= 0:
         raise ValueError("entry_period must be a positive integer.")
-
-    signal = pd.Series(0, index=close.index)
-
-    # Shift Donchian bands by 1 to use the previous bar's Donchian value for the current bar's close.
-    # This aligns with "price breaks out of the previous period's high/low".
-    prev_donchian_upper = donchian_upper_entry.shift(1)
-    prev_donchian_lower = donchian_lower_entry.shift(1)
-
-    # Long entry: Current close breaks above the previous bar's Donchian upper band.
-    long_entry_condition = (close > prev_donchian_upper)
-    # To ensure it's a "cross", we could also check that the previous close was not already above.
-    # close.shift(1) <= prev_donchian_upper.shift(1)  (using a further shift for prev_donchian_upper's previous value)
-    # However, the problem states "H1の価格が過去20期間のH1高値を更新した場合" (price updates the high).
-    # A simple check `close > prev_donchian_upper` captures this "update" or "breakout".
-
-    signal[long_entry_condition] = 1
-
-    # Short entry: Current close breaks below the previous bar's Donchian lower band.
-    short_entry_condition = (close < prev_donchian_lower)
-    signal[short_entry_condition] = -1
-
-    # Ensure that long and short conditions are mutually exclusive if they occur on same bar due to data error or extreme volatility.
-    # If both true (highly unlikely with typical data), prioritize (e.g. set to 0 or handle based on rules)
-    # For now, if short condition is met after long, it will overwrite. This is often acceptable.
-    # A more robust way could be:
-    # signal.loc[long_entry_condition & short_entry_condition] = 0 # Or some other conflict resolution
-    # However, with `close > X` and `close < Y` where X > Y, this is impossible.
-
-    return signal
+    if not len(close) == len(donchian_upper_entry) == len(donchian_lower_entry):
+        raise ValueError("Inputs close, donchian_upper_entry, donchian_lower_entry must have the same length.")
+
+    # Each close is compared with the previous bar's Donchian bands ("price breaks out of the
+    # previous period's high/low"). Long entry: close > previous upper band. Short entry:
+    # close < previous lower band; with upper >= lower both can't hold on the same bar.
+    close_values = close.to_numpy(dtype=np.float64)
+    upper_values = donchian_upper_entry.to_numpy(dtype=np.float64)
+    lower_values = donchian_lower_entry.to_numpy(dtype=np.float64)
+    entry_signal, _ = _breakout_signals(close_values, upper_values, lower_values, upper_values, lower_values,
+                                        np.zeros(len(close_values)))
+    return pd.Series(entry_signal, index=close.index)
 
 def generate_exit_signals(close, donchian_upper_exit, donchian_lower_exit,
                           exit_period_long, exit_period_short, current_positions):
@@ -1071,22 +2024,65 @@ def generate_exit_signals(close, donchian_upper_exit, donchian_lower_exit,
         raise ValueError("exit_period_long must be a positive integer.")
     if not isinstance(exit_period_short, int) or exit_period_short <= 0:
         raise ValueError("exit_period_short must be a positive integer.")
+    if not len(close) == len(donchian_upper_exit) == len(donchian_lower_exit) == len(current_positions):
+        raise ValueError("Inputs close, donchian_upper_exit, donchian_lower_exit, current_positions must have the same length.")
+
+    # Long exit: holding long AND close falls below the previous bar's Donchian lower band.
+    # Short exit: holding short AND close rises above the previous bar's Donchian upper band.
+    close_values = close.to_numpy(dtype=np.float64)
+    upper_values = donchian_upper_exit.to_numpy(dtype=np.float64)
+    lower_values = donchian_lower_exit.to_numpy(dtype=np.float64)
+    _, exit_signal = _breakout_signals(close_values, upper_values, lower_values, upper_values, lower_values,
+                                       current_positions.to_numpy(dtype=np.float64))
+    return pd.Series(exit_signal, index=close.index)
+
+@njit(cache=True, nogil=True)
+def _position_size_kernel(account_equity, risk_percentage, atr, pip_value_per_lot, lot_size,
+                          max_units_per_market, current_units_for_market,
+                          total_risk_percentage_limit, current_total_open_risk_percentage):
+    """
+    Sizing arithmetic of `calculate_position_size` for validated float inputs.
 
-    exit_signal = pd.Series(0, index=close.index)
+    Unit counts are kept as whole-valued floats (np.floor rather than int) so very large
+    intermediate sizes cannot overflow a machine integer before the market cap is applied.
 
-    # Shift Donchian bands by 1 for comparison against current close
-    prev_donchian_lower_exit = donchian_lower_exit.shift(1)
-    prev_donchian_upper_exit = donchian_upper_exit.shift(1)
+    Returns:
+        float: Number of units to trade (whole-valued, 0.0 if no trade should be made).
+    """
+    # 1. Risk Amount per Trade
+    risk_amount_per_trade = account_equity * risk_percentage
 
-    # Long exit: Holding long AND current close falls below the previous bar's 10-period Donchian lower band.
-    long_exit_condition = (current_positions == 1) & (close < prev_donchian_lower_exit)
-    exit_signal[long_exit_condition] = -1 # Signal to exit long
+    # 2. Stop Loss Distance in Pips/Points
+    stop_loss_pips = 2 * atr # Stop loss is 2 * ATR(20)
 
-    # Short exit: Holding short AND current close rises above the previous bar's 10-period Donchian upper band.
-    short_exit_condition = (current_positions == -1) & (close > prev_donchian_upper_exit)
-    exit_signal[short_exit_condition] = 1 # Signal to exit short
+    # 3. Risk per Lot
+    if stop_loss_pips == 0: # ATR is positive, but could be extremely small
+        return 0.0 # Avoid division by zero if stop_loss_pips rounds to 0 or is effectively 0
+    risk_per_lot = stop_loss_pips * pip_value_per_lot
+    if risk_per_lot <= 0: # Should not happen if atr and pip_value_per_lot are positive
+        return 0.0
+
+    # 4. Risk Budget: the per-trade risk, capped by the headroom left under the total risk limit.
+    # Capping the risk before converting to units gives the same size as capping the units after,
+    # with a single division and floor.
+    max_additional_monetary_risk_allowed = (account_equity * total_risk_percentage_limit) - \
+                                           (account_equity * current_total_open_risk_percentage)
+    # Ensure it's not negative due to floating point math or if current risk somehow exceeded limit
+    max_additional_monetary_risk_allowed = max(0.0, max_additional_monetary_risk_allowed)
+    effective_risk = min(risk_amount_per_trade, max_additional_monetary_risk_allowed)
 
-    return exit_signal
+    # 5. Number of Units
+    num_units = np.floor(effective_risk / risk_per_lot * lot_size)
+
+    # 6. Market Limit Constraint
+    available_units_market = max(0.0, max_units_per_market - current_units_for_market)
+    num_units = min(num_units, available_units_market)
+
+    # 7. Ensure num_units is not negative
+    if num_units <= 0:
+        return 0.0
+
+    return num_units
 
 def calculate_position_size(account_equity, risk_percentage, atr,
                             pip_value_per_lot, lot_size,
@@ -1116,8 +2112,8 @@ def calculate_position_size(account_equity, risk_percentage, atr,
     if not all(isinstance(val, int) for val in [lot_size, max_units_per_market, current_units_for_market]):
         raise TypeError("Lot size and unit counts must be integers.")
 
-    # Check for NaN ATR value
-    if pd.isna(atr):
+    # Check for NaN ATR value (NaN is the only float unequal to itself)
+    if atr != atr:
         return 0
 
     if account_equity <= 0:
@@ -1142,59 +2138,12 @@ def calculate_position_size(account_equity, risk_percentage, atr,
         # if existing positions' risk grew or limit was reduced. No new trades then.
         if current_total_open_risk_percentage >= total_risk_percentage_limit:
             return 0 # Already at or over total risk limit
-
-    # 1. Risk Amount per Trade
-    risk_amount_per_trade = account_equity * risk_percentage
-
-    # 2. Stop Loss Distance in Pips/Points
-    stop_loss_pips = 2 * atr # Stop loss is 2 * ATR(20)
-
-    # 3. Risk per Lot
-    if stop_loss_pips == 0 : # ATR is positive, but could be extremely small
-        return 0 # Avoid division by zero if stop_loss_pips rounds to 0 or is effectively 0
-    risk_per_lot = stop_loss_pips * pip_value_per_lot
-    if risk_per_lot <= 0: # Should not happen if atr and pip_value_per_lot are positive
-        return 0
-
-    # 4. Number of Lots (Raw)
-    num_lots_raw = risk_amount_per_trade / risk_per_lot
-
-    # 5. Number of Units (Initial)
-    num_units = math.floor(num_lots_raw * lot_size)
-
-    if num_units <= 0:
-        return 0
-
-    # 6. Market Limit Constraint
-    available_units_market = max_units_per_market - current_units_for_market
-    if available_units_market < 0: # Should not happen with valid inputs
-        available_units_market = 0
-    num_units = min(num_units, available_units_market)
-
-    if num_units <= 0:
-        return 0
-
-    # 7. Total Risk Limit Constraint
-    # Max additional monetary risk we can take on this new trade
-    max_additional_monetary_risk_allowed = (account_equity * total_risk_percentage_limit) - \
-                                           (account_equity * current_total_open_risk_percentage)
-
-    # Ensure it's not negative due to floating point math or if current risk somehow exceeded limit
-    max_additional_monetary_risk_allowed = max(0, max_additional_monetary_risk_allowed)
-
-    # Risk this specific trade would add with the current num_units
-    risk_of_this_trade_monetary = (num_units / lot_size) * risk_per_lot
-
-    if risk_of_this_trade_monetary > max_additional_monetary_risk_allowed:
-        if risk_per_lot > 0:
-            # How many lots can we afford under the remaining risk capital
-            affordable_lots = max_additional_monetary_risk_allowed / risk_per_lot
-            num_units = math.floor(affordable_lots * lot_size)
-        else: # Should be caught by earlier risk_per_lot <=0 check
-            num_units = 0
-
-    # 8. Ensure num_units is not negative and round down (already done by floor)
-    if num_units <= 0:
-        return 0
-
-    return int(num_units) # Return as integer
+    if current_units_for_market >= max_units_per_market:
+        return 0 # No headroom left in this market; skip the risk arithmetic entirely
+
+    # Steps 1-7 are plain scalar arithmetic, run as a compiled kernel on float arguments
+    return int(_position_size_kernel(
+        float(account_equity), float(risk_percentage), float(atr), float(pip_value_per_lot), float(lot_size),
+        float(max_units_per_market), float(current_units_for_market),
+        float(total_risk_percentage_limit), float(current_total_open_risk_percentage)
+    ))